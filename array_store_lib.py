@@ -0,0 +1,77 @@
+import json
+import os
+import shutil
+import numpy as np
+
+# An array store is a folder of .npy files (which can be memory-mapped when read)
+# with a meta.json listing them, along with other JSON metadata.
+# meta.json is written last, so an interrupted write leaves no valid store.
+
+
+def write_arrays(dirname, arrays, meta=None):
+    start_writing(dirname)
+    for name, array in arrays.items():
+        np.save(os.path.join(dirname, name + '.npy'), array)
+    write_meta(dirname, dict(meta or {}, arrays=list(arrays.keys())))
+
+
+def start_writing(dirname):
+    os.makedirs(dirname, exist_ok=True)
+    meta_filename = os.path.join(dirname, 'meta.json')
+    if os.path.exists(meta_filename):
+        os.remove(meta_filename)
+
+
+def write_meta(dirname, meta):
+    meta_filename = os.path.join(dirname, 'meta.json')
+    with open(meta_filename + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(meta_filename + '.tmp', meta_filename)
+
+
+def read_meta(dirname):
+    # Returns None if there is no valid store
+    try:
+        with open(os.path.join(dirname, 'meta.json'), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_arrays(dirname, mmap_mode='r'):
+    meta = read_meta(dirname)
+    if meta is None:
+        raise FileNotFoundError(f'No array store in {dirname}')
+    arrays = dict([(name, np.load(os.path.join(dirname, name + '.npy'), mmap_mode))
+                   for name in meta['arrays']])
+    return arrays, meta
+
+
+class ArrayStoreWriter:
+    # Writes a store of 1-d arrays by appending to them, so their values need not all be in memory.
+    # Values are appended to raw files, which become the .npy files in close().
+    def __init__(self, dirname, dtypes):
+        start_writing(dirname)
+        self.dirname = dirname
+        self.dtypes = dict([(name, np.dtype(dtype)) for name, dtype in dtypes.items()])
+        self.files = dict([(name, open(os.path.join(dirname, name + '.raw'), 'wb')) for name in dtypes])
+        self.sizes = dict([(name, 0) for name in dtypes])
+
+    def append(self, name, values):
+        values = np.asarray(values, dtype=self.dtypes[name]).reshape(-1)
+        self.files[name].write(values.tobytes())
+        self.sizes[name] += len(values)
+
+    def close(self, meta=None):
+        for name, f in self.files.items():
+            f.close()
+            raw_filename = os.path.join(self.dirname, name + '.raw')
+            with open(os.path.join(self.dirname, name + '.npy'), 'wb') as out, open(raw_filename, 'rb') as raw:
+                np.lib.format.write_array_header_1_0(out, {
+                    'descr': np.lib.format.dtype_to_descr(self.dtypes[name]),
+                    'fortran_order': False,
+                    'shape': (self.sizes[name],),
+                })
+                shutil.copyfileobj(raw, out, 1024 * 1024)
+            os.remove(raw_filename)
+        write_meta(self.dirname, dict(meta or {}, arrays=list(self.files.keys())))
@@ -0,0 +1,23 @@
+import os
+import benchmark_lib as lib
+from sys import argv
+
+if __name__ == '__main__':  # Required for reading files in worker processes
+    work_dir = argv[1] if len(argv) > 1 else 'benchmark'
+    doculect_count = int(argv[2]) if len(argv) > 2 else 1000
+    year_count = int(argv[3]) if len(argv) > 3 else 1
+    workers = int(argv[4]) if len(argv) > 4 else None
+
+    results = lib.run_pipeline(work_dir, doculect_count, year_count, workers)
+    print()
+    # Results of the first run of each size are kept as the baseline of later runs
+    baseline_filename = os.path.join(work_dir, f'baseline_{doculect_count}_{year_count}.json')
+    if not os.path.exists(baseline_filename):
+        lib.write_results(results, baseline_filename)
+        print('Baseline saved as', baseline_filename)
+    else:
+        regressions = lib.compare_results(results, lib.read_results(baseline_filename))
+        lib.write_results(results, os.path.join(work_dir, f'last_{doculect_count}_{year_count}.json'))
+        if regressions:
+            print('Regressions:', ', '.join(regressions))
+            exit(1)
@@ -0,0 +1,234 @@
+import json
+import os
+import random
+import time
+import tracemalloc
+import numpy as np
+from netCDF4 import Dataset
+from pyasjp.api import ASJP
+from pyasjp.meanings import MEANINGS_ALL
+from pyasjp.models import Doculect, Synset, Word
+import get_sonority_lib
+import get_temperature_lib
+
+CONSONANTS = 'pbfvmw8tdszcnrlSZCjT5ykgxNqXh7L4G!'
+VOWELS = '3iueEoa'
+FAMILIES = ['AA', 'NC', 'IE', 'ST', 'AN', 'AU']
+REGRESSION_RATIO = 1.25  # Stages slower than in the baseline by more than this ratio are regressions,
+SECONDS_FLOOR = 0.2  # with times of at least this, as times of very short stages vary a lot
+MEMORY_REGRESSION_RATIO = 1.5  # Also stages with a peak memory higher by more than this ratio,
+MEMORY_FLOOR_MB = 1.0  # compared with at least this peak, as tiny peaks vary a lot
+
+
+def write_fldas(path, year_range, seed=0):
+    # Synthetic FLDAS files of year_range in path: masked 1500 x 3600 grids of Tair_f_tavg (in K),
+    # with the same land mask in all months. Existing files are kept.
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:1500, 0:3600]
+    land = np.sin(x / 300) + np.cos(y / 170) + 0.3 * np.sin(x / 37 + y / 23) > 0.2
+    base = 300 - np.abs(y - 600) / 30
+    for year in year_range:
+        for month in range(1, 13):
+            filename = get_temperature_lib.get_fldas_filename(path, year, month)
+            if filename.exists():
+                continue
+            os.makedirs(filename.parent, exist_ok=True)
+            with Dataset(str(filename) + '.tmp', 'w', format='NETCDF4') as nc:
+                nc.createDimension('time', 1)
+                nc.createDimension('Y', 1500)
+                nc.createDimension('X', 3600)
+                var = nc.createVariable('Tair_f_tavg', 'f4', ('time', 'Y', 'X'), zlib=True, fill_value=-9999.0)
+                var.units = 'K'
+                values = base + 10 * np.sin(month + y / 200) + rng.normal(0, 1, (1500, 3600))
+                var[0] = np.ma.array(values, mask=~land)
+            os.replace(str(filename) + '.tmp', filename)
+
+
+def write_asjp(raw_dir, doculect_count, seed=0):
+    # Synthetic lists.txt of doculect_count doculects in raw_dir, all of which pass
+    # get_sonority_lib.is_doculect_included()
+    rng = random.Random(seed)
+    meanings = sorted(MEANINGS_ALL.items())[:100]
+    doculects = []
+    for i in range(doculect_count):
+        synsets = [Synset(meaning_id, meaning,
+                          [Word(get_random_word(rng), rng.random() < 0.05) for _ in range(rng.choice([1, 1, 1, 2, 3]))],
+                          None)
+                   for meaning_id, meaning in meanings if rng.random() > 0.15]
+        doculects.append(Doculect(
+            id=f'LANG_{i}', name=f'Lang {i}',
+            classification_wals=f'{rng.choice(FAMILIES)}.G{rng.randint(0, 20)}',
+            classification_ethnologue='', classification_glottolog=None,
+            latitude=round(rng.uniform(-55, 85), 2), longitude=round(rng.uniform(-179, 179), 2),
+            number_of_speakers=0, recently_extinct=False, long_extinct=False, year_of_extinction=None,
+            code_wals='', code_iso='xxx', synsets=synsets))
+    os.makedirs(raw_dir, exist_ok=True)
+    with open(os.path.join(raw_dir, 'lists.txt.tmp'), 'w') as f:
+        f.write(ASJP(raw_dir).to_txt(*doculects))
+    os.replace(os.path.join(raw_dir, 'lists.txt.tmp'), os.path.join(raw_dir, 'lists.txt'))
+
+
+def get_random_word(rng):
+    # 1-7 segments, with modifiers, multi-token phones and geminates as in ASJPcode
+    word = ''
+    for _ in range(rng.randint(1, 7)):
+        if rng.random() < 0.45:
+            segment = rng.choice(VOWELS)
+            if rng.random() < 0.05:
+                segment += '*'
+        else:
+            segment = rng.choice(CONSONANTS)
+            r = rng.random()
+            if r < 0.05:
+                segment += '"'
+            elif r < 0.12:
+                segment += rng.choice('wyhx') + '~'
+            elif r < 0.16:
+                segment = rng.choice('mnN') + rng.choice('pbtdkg') + '~'
+            elif r < 0.18:
+                segment = rng.choice('tdk') + rng.choice('sS') + rng.choice('wy') + '$'
+        if rng.random() < 0.03:
+            segment += segment
+        word += segment
+    return word
+
+
+class Benchmark:
+    # Time and peak memory of each stage. As tracing memory slows down Python code a lot, each stage is
+    # timed first, by the fastest of repeat runs, then run with memory traced (by tracemalloc, so only in this process).
+    # setup: called before each run, e.g. to clear caches
+    # make_args: called before each run for the arguments of func instead of args, e.g. for fresh copies
+    #   of rows that func changes, so that both runs have the same input
+    def __init__(self, trace_memory=True, repeat=5):
+        self.trace_memory = trace_memory
+        self.repeat = repeat
+        self.results = {}
+
+    def run(self, stage, items, unit, func, *args, setup=None, make_args=None, **kwargs):
+        seconds = None
+        for i in range(self.repeat):
+            if setup:
+                setup()
+            run_args = make_args() if make_args else args
+            start = time.perf_counter()
+            run_result = func(*run_args, **kwargs)
+            run_seconds = time.perf_counter() - start
+            if i == 0:
+                result = run_result
+            seconds = run_seconds if seconds is None else min(seconds, run_seconds)
+        peak = 0
+        if self.trace_memory:
+            if setup:
+                setup()
+            run_args = make_args() if make_args else args
+            tracemalloc.start()
+            func(*run_args, **kwargs)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.results[stage] = {
+            'seconds': seconds,
+            'peak_mb': peak / 2 ** 20,
+            'items': items,
+            'unit': unit,
+        }
+        print('%-36s %9.3f s %12.0f %s/s %9.1f MB' % (stage, seconds, items / seconds, unit, peak / 2 ** 20))
+        return result
+
+
+def run_pipeline(work_dir, doculect_count=1000, year_count=1, workers=None, repeat=5):
+    # Generates synthetic inputs in work_dir (once for each size), then runs each stage of the pipeline.
+    # Returns results of Benchmark.
+    raw_dir = os.path.join(work_dir, f'asjp_{doculect_count}')
+    fldas_dir = os.path.join(work_dir, 'fldas')
+    out_dir = os.path.join(work_dir, 'output')
+    os.makedirs(out_dir, exist_ok=True)
+    if not os.path.exists(os.path.join(raw_dir, 'lists.txt')):
+        print('Generating ASJP data in', raw_dir)
+        write_asjp(raw_dir, doculect_count)
+    year_range = range(1982, 1982 + year_count)
+    print('Generating FLDAS data in', fldas_dir)
+    write_fldas(fldas_dir, year_range)
+    print()
+
+    benchmark = Benchmark(repeat=repeat)
+    doculects = benchmark.run('open_doculects', doculect_count, 'doculects',
+                              get_sonority_lib.open_doculects, raw_dir)
+    cache_dir = os.path.join(out_dir, 'asjp_cache')
+    get_sonority_lib.open_doculects(raw_dir, cache_dir)  # Builds the cache if needed
+    benchmark.run('open_doculects (cached)', doculect_count, 'doculects',
+                  get_sonority_lib.open_doculects, raw_dir, cache_dir)
+
+    benchmark.run('get_all_sonority_indices', doculect_count, 'doculects',
+                  get_sonority_lib.get_all_sonority_indices, doculects, True, False, workers=workers,
+                  setup=get_sonority_lib.phones_cache.clear)
+    measures = benchmark.run('get_all_measures', doculect_count, 'doculects',
+                             get_sonority_lib.get_all_measures, doculects, True, False, workers=workers,
+                             setup=get_sonority_lib.phones_cache.clear)
+    sonorities_filename = os.path.join(out_dir, 'sonorities.csv')
+    get_sonority_lib.write_scored_doculects(zip(doculects, measures), sonorities_filename)
+
+    names, geometries = get_temperature_lib.read_names_and_geometries(sonorities_filename)
+    points = get_temperature_lib.coords_2_points(geometries)
+    condition = np.full((1500, 3600), False)
+    condition[points[:, 1], points[:, 0]] = True
+    temperatures = benchmark.run('get_temperatures_by_condition', int(condition.sum()) * year_count * 12, 'cell-months',
+                                 get_temperature_lib.get_temperatures_by_condition,
+                                 fldas_dir, condition, True, year_range, workers=workers)
+    temperatures_filename = os.path.join(out_dir, 'temperatures.csv')
+    benchmark.run('write_temperatures_by_doculects', len(names), 'doculects',
+                  get_temperature_lib.write_temperatures_by_doculects,
+                  names, geometries, temperatures, temperatures_filename)
+
+    # Imported here, as plotting packages are needed only for these stages
+    import process_lib
+    data = benchmark.run('read_data', len(names), 'doculects',
+                         process_lib.read_data, temperatures_filename, sonorities_filename)
+    grouped = benchmark.run('grouped_by', len(data), 'doculects',
+                            lambda: [process_lib.grouped_by(data, key) for key in ('Macroarea', 'Family', 'Genus')])
+    # Transformed values are added to the rows, so each run transforms its own copies of them
+    def transform_levels(levels):
+        process_lib.transform_levels(levels, workers)
+        return levels
+    transformed = benchmark.run('transform_data', len(data) + len(grouped[1]) + len(grouped[2]), 'rows',
+                                transform_levels, setup=process_lib.lambdas_cache.clear,
+                                make_args=lambda: ([[dict(d) for d in level] for level in (data, grouped[1], grouped[2])],))
+    levels = [transformed[0], grouped[0], transformed[1], transformed[2]]
+    benchmark.run('write_data', sum([len(i) for i in levels]), 'rows',
+                  lambda: [process_lib.write_data(i, os.path.join(out_dir, name)) for i, name in zip(
+                      levels, ['data.csv', 'data_macroarea.csv', 'data_family.csv', 'data_genus.csv'])])
+    return benchmark.results
+
+
+def compare_results(results, baseline):
+    # Prints times and peak memory relative to baseline, and returns stages slower by more than
+    # REGRESSION_RATIO, or with a peak memory higher by more than MEMORY_REGRESSION_RATIO.
+    # Times are compared as at least SECONDS_FLOOR, so very short stages are never regressions.
+    regressions = []
+    print('%-36s %11s %11s %7s %11s %7s' % ('stage', 'baseline', 'now', 'ratio', 'peak MB', 'ratio'))
+    for stage, result in results.items():
+        if stage not in baseline:
+            continue
+        ratio = max(result['seconds'], SECONDS_FLOOR) / max(baseline[stage]['seconds'], SECONDS_FLOOR)
+        memory_ratio = result['peak_mb'] / max(baseline[stage]['peak_mb'], MEMORY_FLOOR_MB)
+        flags = []
+        if ratio > REGRESSION_RATIO:
+            regressions.append(stage)
+            flags.append('REGRESSION')
+        # Peaks are 0 if memory was not traced
+        if baseline[stage]['peak_mb'] and memory_ratio > MEMORY_REGRESSION_RATIO:
+            regressions.append(stage + ' (memory)')
+            flags.append('MEMORY REGRESSION')
+        print('%-36s %9.3f s %9.3f s %7.2f %11.1f %7.2f%s' % (
+            stage, baseline[stage]['seconds'], result['seconds'], ratio, result['peak_mb'], memory_ratio,
+            ''.join(['  ' + i for i in flags])))
+    return regressions
+
+
+def write_results(results, json_filename):
+    with open(json_filename, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def read_results(json_filename):
+    with open(json_filename, 'r') as f:
+        return json.load(f)
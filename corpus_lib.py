@@ -0,0 +1,89 @@
+import numpy as np
+from scipy import sparse
+from sonority_index_lib import word2phones, get_phone_table
+from segments_lib import segment_means
+
+
+def sizes2offsets(sizes):
+    return np.concatenate(([0], np.cumsum(sizes, dtype=np.int64)))
+
+
+class Corpus:
+    # Integer-coded columnar corpus built from compact form data (see get_sonority_lib.doculect2forms)
+    # phone_ids: IDs (in the default phone table) of all phones of all words in a row
+    # word_offsets, synset_offsets, doculect_offsets: where each word starts in phone_ids,
+    #   each synset in words and each doculect in synsets, with the total count appended
+    # loans: whether each word is a loan
+    def __init__(self, forms, merge_vowels=False):
+        self.table = get_phone_table()
+        self.merge_vowels = merge_vowels
+        phone_ids = []
+        word_lengths = []
+        synset_sizes = []
+        doculect_sizes = []
+        loans = []
+        for doculect in forms:
+            doculect_sizes.append(len(doculect))
+            for synset in doculect:
+                synset_sizes.append(len(synset))
+                for form, loan in synset:
+                    ids = self.table.phones2ids(word2phones(form, merge_vowels))
+                    phone_ids += ids
+                    word_lengths.append(len(ids))
+                    loans.append(loan)
+        self.phone_ids = np.array(phone_ids, dtype=np.int32)
+        self.word_offsets = sizes2offsets(word_lengths)
+        self.synset_offsets = sizes2offsets(synset_sizes)
+        self.doculect_offsets = sizes2offsets(doculect_sizes)
+        self.loans = np.array(loans, dtype=bool)
+
+    def __len__(self):
+        return len(self.doculect_offsets) - 1
+
+    def get_phone_values(self, table=None):
+        # Rows of table.values in the order of the phone IDs of this corpus
+        if table is None or table is self.table:
+            return self.table.values[:len(self.table)]
+        ids = table.phones2ids(self.table.phones)  # May add rows to table.values
+        return table.values[ids]
+
+    def get_word_values(self, phone_values):
+        return segment_means(phone_values[self.phone_ids], self.word_offsets)
+
+    def get_word_lengths(self):
+        return np.diff(self.word_offsets).astype(float)
+
+    def get_doculect_values(self, word_values, average_by_meaning, with_loan):
+        kept = np.full(len(self.loans), True) if with_loan else ~self.loans
+        # Offsets of synsets among the kept words
+        synset_offsets = sizes2offsets(kept)[self.synset_offsets]
+        word_values = word_values[kept]
+        if not average_by_meaning:
+            return segment_means(word_values, synset_offsets[self.doculect_offsets])
+        synset_values = segment_means(word_values, synset_offsets)
+        # Synsets having only loans are skipped
+        has_words = np.diff(synset_offsets) > 0
+        return segment_means(synset_values[has_words],
+                             sizes2offsets(has_words)[self.doculect_offsets])
+
+    def get_phone_weights(self, average_by_meaning, with_loan):
+        # Sparse (doculect x phone ID) matrix W, so that W @ phone_values equals
+        # get_doculect_values(get_word_values(phone_values), ...) for any phone values
+        word_lengths = np.diff(self.word_offsets)
+        word_synsets = np.repeat(np.arange(len(self.synset_offsets) - 1), np.diff(self.synset_offsets))
+        synset_doculects = np.repeat(np.arange(len(self)), np.diff(self.doculect_offsets))
+        word_doculects = synset_doculects[word_synsets]
+        kept = np.full(len(self.loans), True) if with_loan else ~self.loans
+        if average_by_meaning:
+            synset_sizes = np.bincount(word_synsets[kept], minlength=len(synset_doculects))
+            doculect_sizes = np.bincount(synset_doculects[synset_sizes > 0], minlength=len(self))
+            word_weights = kept / np.maximum(synset_sizes[word_synsets], 1) \
+                / np.maximum(doculect_sizes[word_doculects], 1)
+        else:
+            doculect_sizes = np.bincount(word_doculects[kept], minlength=len(self))
+            word_weights = kept / np.maximum(doculect_sizes[word_doculects], 1)
+        phone_words = np.repeat(np.arange(len(word_lengths)), word_lengths)
+        return sparse.csr_matrix(
+            ((word_weights / np.maximum(word_lengths, 1))[phone_words],
+             (word_doculects[phone_words], self.phone_ids)),
+            shape=(len(self), len(self.table)))
@@ -0,0 +1,13 @@
+import correlation_lib as lib
+import process_lib
+from sys import argv
+
+if __name__ == '__main__':  # Required for running replicates in worker processes
+    method = argv[1] if len(argv) > 1 else 'permutation'
+    block_key = argv[2] if len(argv) > 2 and argv[2] != 'none' else None
+    count = int(argv[3]) if len(argv) > 3 else 10000
+    workers = int(argv[4]) if len(argv) > 4 else None
+
+    columns = process_lib.read_columns('data/temperatures.csv', 'data/sonorities.csv')
+    rows = lib.test_correlations(columns, method, block_key, count, workers=workers)
+    lib.write_correlations(rows, f'data/correlations_{method}_{(block_key or "none").lower()}.csv')
@@ -0,0 +1,121 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+
+INDEX_KEYS = ['Index%d' % i for i in range(7)]
+TEMPERATURE_KEYS = ['T', 'T_max', 'T_min', 'T_sd', 'T_diff']
+CHUNK_SIZE = 100  # Replicates in each task, so results do not depend on the number of workers
+
+
+def get_correlations(x, y):
+    # Pearson correlations of each column of x (row x column) with each column of y, as (x column x y column)
+    x = (x - x.mean(0)) / x.std(0)
+    y = (y - y.mean(0)) / y.std(0)
+    return x.T @ y / len(x)
+
+
+def get_blocks(labels):
+    # Block number of each row; each row is its own block if labels is None
+    if labels is None:
+        return None
+    return np.unique(labels, return_inverse=True)[1].reshape(-1)
+
+
+def permute_within_blocks(blocks, count, rng):
+    # (replicate x row) indices of rows, shuffled within blocks
+    # Rows in random order, then stably sorted by block: rows of each block in random order,
+    # which take the places of the rows of the block in order
+    order = np.argsort(rng.random((count, len(blocks))), axis=1)
+    order = np.take_along_axis(order, np.argsort(blocks[order], axis=1, kind='stable'), 1)
+    result = np.empty(order.shape, dtype=int)
+    result[:, np.argsort(blocks, kind='stable')] = order
+    return result
+
+
+def get_permutation_correlations(x, y, blocks, count, seed):
+    # Correlations of count permutations of the rows of x (within blocks) with y, as (replicate x x column x y column)
+    rng = np.random.default_rng(seed)
+    if blocks is None:
+        permutations = rng.permuted(np.tile(np.arange(len(x)), (count, 1)), axis=1)
+    else:
+        permutations = permute_within_blocks(blocks, count, rng)
+    # Permutations keep means and standard deviations, so x and y are standardized once
+    x = (x - x.mean(0)) / x.std(0)
+    y = (y - y.mean(0)) / y.std(0)
+    return np.einsum('rni,nj->rij', x[permutations], y) / len(x)
+
+
+def get_bootstrap_correlations(x, y, blocks, count, seed):
+    # Correlations of count bootstrap samples of rows (of whole blocks), as (replicate x x column x y column).
+    # Samples are weights of rows (the number of times each block is drawn), so all replicates are
+    # computed as weighted sums in matrix products.
+    rng = np.random.default_rng(seed)
+    if blocks is None:
+        blocks = np.arange(len(x))
+    block_count = blocks.max() + 1
+    weights = rng.multinomial(block_count, np.full(block_count, 1 / block_count), count)[:, blocks].astype(float)
+    x = x - x.mean(0)
+    y = y - y.mean(0)
+    total = weights.sum(1).reshape(-1, 1, 1)
+    sum_x = (weights @ x)[:, :, None]
+    sum_y = (weights @ y)[:, None, :]
+    sum_xx = (weights @ x ** 2)[:, :, None]
+    sum_yy = (weights @ y ** 2)[:, None, :]
+    sum_xy = (weights @ (x[:, :, None] * y[:, None, :]).reshape(len(x), -1)).reshape(count, x.shape[1], y.shape[1])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (total * sum_xy - sum_x * sum_y) / np.sqrt(
+            (total * sum_xx - sum_x ** 2) * (total * sum_yy - sum_y ** 2))
+
+
+def get_replicate_correlations(x, y, method, blocks=None, count=10000, seed=0, workers=None):
+    # Correlations of count replicates of method ('permutation' or 'bootstrap'), as in
+    # get_permutation_correlations() or get_bootstrap_correlations().
+    # Replicates are run in chunks of CHUNK_SIZE, each with its own seed spawned from seed,
+    # so the results are the same with any number of workers.
+    func = {
+        'permutation': get_permutation_correlations,
+        'bootstrap': get_bootstrap_correlations,
+    }[method]
+    counts = [min(CHUNK_SIZE, count - i) for i in range(0, count, CHUNK_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    if not workers or len(counts) < 2:
+        results = list(map(func, repeat(x), repeat(y), repeat(blocks), counts, seeds))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(func, repeat(x), repeat(y), repeat(blocks), counts, seeds))
+    return np.concatenate(results) if results else np.empty((0, x.shape[1], y.shape[1]))
+
+
+def test_correlations(columns, method, block_key=None, count=10000, seed=0, workers=None,
+                      x_keys=INDEX_KEYS, y_keys=TEMPERATURE_KEYS):
+    # Correlations of x_keys with y_keys in columns (as of process_lib.read_columns()), with replicates of method
+    # resampled within (permutation) or by (bootstrap) groups of block_key (e.g. 'Family', 'Genus' or 'Macroarea').
+    # Returns rows of x key, y key, r, and p (two-sided) for permutations, or the standard error and
+    # 95% confidence interval for bootstraps.
+    x_keys = [k for k in x_keys if k in columns]
+    x = np.column_stack([columns[k] for k in x_keys]).astype(float)
+    y = np.column_stack([columns[k] for k in y_keys]).astype(float)
+    observed = get_correlations(x, y)
+    replicates = get_replicate_correlations(
+        x, y, method, get_blocks(columns[block_key] if block_key else None), count, seed, workers)
+    if method == 'permutation':
+        p = (1 + (np.abs(replicates) >= np.abs(observed) - 1e-12).sum(0)) / (count + 1)
+        statistics = [('p', p)]
+    else:
+        statistics = [
+            ('SE', np.nanstd(replicates, 0)),
+            ('CI_low', np.nanpercentile(replicates, 2.5, 0)),
+            ('CI_high', np.nanpercentile(replicates, 97.5, 0)),
+        ]
+    return [dict(
+        [('Index', x_key), ('Temperature', y_key), ('r', observed[i, j])] +
+        [(name, values[i, j]) for name, values in statistics]
+    ) for i, x_key in enumerate(x_keys) for j, y_key in enumerate(y_keys)]
+
+
+def write_correlations(rows, csv_filename):
+    keys = list(rows[0].keys())
+    with open(csv_filename, 'w') as f:
+        f.write(','.join(keys) + '\n')
+        f.writelines([','.join(['%.4f' % row[k] if isinstance(row[k], float) else row[k] for k in keys]) + '\n'
+                      for row in rows])
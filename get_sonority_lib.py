@@ -1,6 +1,17 @@
 import os.path
+import dataclasses
+import gc
+import hashlib
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
 from sonority_index_lib import *
+from corpus_lib import Corpus, sizes2offsets
+from array_store_lib import ArrayStoreWriter, read_arrays, read_meta
 from pyasjp.api import ASJP
+from pyasjp.models import Doculect, Synset, Word
 from lingpy.sequence.sound_classes import tokens2class
 from lingpy.settings import rc
 
@@ -19,37 +30,197 @@ doculects_to_exclude = [
 VOWELS = '3iueEoa'
 
 
-def open_doculects(raw_dir):
-    asjp = ASJP(raw_dir)
-    doculects = list(asjp.iter_doculects())
-    return doculects
+ASJP_CACHE_VERSION = 2
+
+
+def open_doculects(raw_dir, cache_dir=None):
+    # Creating many small objects would otherwise trigger lots of garbage collections
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return list(iter_doculects(raw_dir, cache_dir))
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def iter_doculects(raw_dir, cache_dir=None):
+    # With cache_dir, parsed doculects are read from an array store there,
+    # which is (re)built when it is missing or lists.txt in raw_dir has changed
+    if cache_dir is None:
+        yield from ASJP(raw_dir).iter_doculects()
+        return
+    fingerprint = get_asjp_fingerprint(raw_dir)
+    meta = read_meta(cache_dir)
+    if meta is None or meta.get('fingerprint') != fingerprint:
+        print('Building ASJP cache in', cache_dir)
+        yield from write_doculects_cache(ASJP(raw_dir).iter_doculects(), cache_dir, fingerprint)
+        return
+    yield from iter_cached_doculects(cache_dir)
+
+
+def get_asjp_fingerprint(raw_dir):
+    sha = hashlib.sha1(f'version {ASJP_CACHE_VERSION}'.encode())
+    with open(Path(raw_dir) / 'lists.txt', 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def write_doculects_cache(doculects, cache_dir, fingerprint):
+    # Yields doculects while appending each to the cache, which is valid once all are written.
+    # Metadata of doculects and comments of synsets are JSON and text in arrays, so they are
+    # read for each doculect in turn, as the rest is.
+    fields = [f.name for f in dataclasses.fields(Doculect) if f.name != 'synsets']
+    writer = ArrayStoreWriter(cache_dir, {
+        'doculect_offsets': np.int64,
+        'doculect_value_offsets': np.int64,
+        'doculect_values': np.uint8,
+        'synset_offsets': np.int64,
+        'meaning_ids': np.int32,
+        'meanings': np.int32,
+        'comment_offsets': np.int64,
+        'comments': np.uint8,
+        'form_offsets': np.int64,
+        'forms': np.uint8,
+        'loans': bool,
+    })
+    for name in ('doculect_offsets', 'doculect_value_offsets', 'synset_offsets', 'comment_offsets', 'form_offsets'):
+        writer.append(name, [0])
+    meaning2index = {}
+    for d in doculects:
+        values = json.dumps([getattr(d, f) for f in fields]).encode()
+        comments = [(s.comment or '').encode() for s in d.synsets]
+        forms = [w.form.encode() for s in d.synsets for w in s.words]
+        writer.append('doculect_offsets', writer.sizes['meanings'] + len(d.synsets))
+        writer.append('doculect_value_offsets', writer.sizes['doculect_values'] + len(values))
+        writer.append('doculect_values', np.frombuffer(values, dtype=np.uint8))
+        writer.append('synset_offsets', writer.sizes['loans'] + sizes2offsets([len(s.words) for s in d.synsets])[1:])
+        writer.append('meaning_ids', [s.meaning_id for s in d.synsets])
+        writer.append('meanings', [meaning2index.setdefault(s.meaning, len(meaning2index)) for s in d.synsets])
+        writer.append('comment_offsets', writer.sizes['comments'] + sizes2offsets([len(c) for c in comments])[1:])
+        writer.append('comments', np.frombuffer(b''.join(comments), dtype=np.uint8))
+        writer.append('form_offsets', writer.sizes['forms'] + sizes2offsets([len(f) for f in forms])[1:])
+        writer.append('forms', np.frombuffer(b''.join(forms), dtype=np.uint8))
+        writer.append('loans', [w.loan for s in d.synsets for w in s.words])
+        yield d
+    writer.close({
+        'fingerprint': fingerprint,
+        'fields': fields,
+        'meanings': list(meaning2index.keys()),
+    })
+
+
+def iter_cached_doculects(cache_dir):
+    # Arrays are memory-mapped, so only the doculect being built is read
+    arrays, meta = read_arrays(cache_dir)
+    arrays = dict([(k, v.view(np.ndarray)) for k, v in arrays.items()])
+    doculect_offsets = arrays['doculect_offsets']
+    value_offsets = arrays['doculect_value_offsets']
+    synset_offsets = arrays['synset_offsets']
+    comment_offsets = arrays['comment_offsets']
+    form_offsets = arrays['form_offsets']
+    fields = meta['fields']
+    meanings = meta['meanings']
+
+    # Cached data were validated when parsed, so __post_init__() is skipped
+    new = object.__new__
+
+    def build_word(form, loan):
+        word = new(Word)
+        word.form = form
+        word.loan = loan
+        return word
+
+    def build_synset(meaning_id, meaning, comment, words):
+        synset = new(Synset)
+        synset.meaning_id = meaning_id
+        synset.meaning = meanings[meaning]
+        synset.words = words
+        synset.comment = comment.decode() or None
+        return synset
+    for i in range(len(doculect_offsets) - 1):
+        s0, s1 = doculect_offsets[i], doculect_offsets[i + 1]
+        w0, w1 = synset_offsets[s0], synset_offsets[s1]
+        text = arrays['forms'][form_offsets[w0]:form_offsets[w1]].tobytes().decode()
+        offsets = (form_offsets[w0:w1 + 1] - form_offsets[w0]).tolist()
+        words = [build_word(text[start:end], loan) for start, end, loan in
+                 zip(offsets[:-1], offsets[1:], arrays['loans'][w0:w1].tolist())]
+        comments = arrays['comments'][comment_offsets[s0]:comment_offsets[s1]].tobytes()
+        comment_starts = (comment_offsets[s0:s1 + 1] - comment_offsets[s0]).tolist()
+        offsets = (synset_offsets[s0:s1 + 1] - w0).tolist()
+        synsets = [build_synset(meaning_id, meaning, comments[c0:c1], words[start:end])
+                   for start, end, c0, c1, meaning_id, meaning in zip(
+                       offsets[:-1], offsets[1:], comment_starts[:-1], comment_starts[1:],
+                       arrays['meaning_ids'][s0:s1].tolist(), arrays['meanings'][s0:s1].tolist())]
+        values = json.loads(arrays['doculect_values'][value_offsets[i]:value_offsets[i + 1]].tobytes())
+        doculect = new(Doculect)
+        doculect.__dict__.update(zip(fields, values))
+        doculect.synsets = synsets
+        yield doculect
+
+
+class DoculectsInfo:
+    # Counts for print_doculects_info(), which can be collected while streaming doculects
+    def __init__(self):
+        self.doculect_count = 0
+        self.meaning_count = 0
+        self.word_count = 0
+        self.names = [set(), set(), set(), set()]
+
+    def add(self, d):
+        self.doculect_count += 1
+        self.meaning_count += len(d.synsets)
+        self.word_count += sum([len(synset.words) for synset in d.synsets])
+        names = (
+            d.code_iso,
+            (d.classification_wals or '').split('.')[0],
+            (d.classification_ethnologue or '').split(',')[0],
+            (d.classification_glottolog or '').split(',')[0],
+        )
+        for i, name in enumerate(names):
+            # Null language/family names are excluded
+            if name:
+                self.names[i].add(name)
+
+    def print(self):
+        print(
+            'Total:', self.doculect_count, 'doculects, having',
+            self.meaning_count, 'meanings and',
+            self.word_count, 'words',
+        )
+        counts = [len(i) for i in self.names]
+        print(
+            'Corresponding to:',
+            counts[0], 'languages,',
+            counts[1], 'families (WALS),',
+            counts[2], 'families (Ethnologue),',
+            counts[3], 'families (Glottolog)',
+        )
+        print()
 
 
 def print_doculects_info(doculects):
-    print(
-        'Total:', len(doculects), 'doculects, having',
-        sum([len(doculect.synsets)
-            for doculect in doculects]), 'meanings and',
-        sum([sum([len(synset.words) for synset in doculect.synsets])
-            for doculect in doculects]), 'words',
-    )
-    names = [(
-        d.code_iso,
-        (d.classification_wals or '').split('.')[0],
-        (d.classification_ethnologue or '').split(',')[0],
-        (d.classification_glottolog or '').split(',')[0],
-    ) for d in doculects]
-    counts = [len(set([c[i] for c in names if c[i]]))
-              for i in range(len(names[0]))]
-    # Null language/family names are excluded
-    print(
-        'Corresponding to:',
-        counts[0], 'languages,',
-        counts[1], 'families (WALS),',
-        counts[2], 'families (Ethnologue),',
-        counts[3], 'families (Glottolog)',
-    )
-    print()
+    info = DoculectsInfo()
+    for d in doculects:
+        info.add(d)
+    info.print()
+
+
+def is_doculect_included(d):
+    return 'Oth' not in d.classification_wals and \
+        d.code_iso and \
+        not d.long_extinct and \
+        d.name not in doculects_to_exclude and \
+        len(d.synsets) >= 20 and \
+        d.latitude is not None
+
+
+def read_names_with_temperature(temperature_data):
+    with open(temperature_data, 'r') as f:
+        next(f)
+        lines = [line for line in f if '--' not in line]
+    return set([line.split(',')[0] for line in lines])
 
 
 def filter_doculects(doculects, words_to_include=None, temperature_data=''):
@@ -59,77 +230,162 @@ def filter_doculects(doculects, words_to_include=None, temperature_data=''):
             d.synsets = [s for s in d.synsets if s.meaning in words_to_include]
         print(f'After intersection with {len(words_to_include)}:')
         print_doculects_info(doculects)
-    doculects = [d for d in doculects if
-                 'Oth' not in d.classification_wals and  # Artificial/Creoles/Pidgins
-                 d.code_iso and  # Proto languages
-                 not d.long_extinct and  # Ancient languages
-                 d.name not in doculects_to_exclude and
-                 len(d.synsets) >= 20 and
-                 d.latitude is not None]
+    # Excluded: artificial languages, creoles and pidgins ('Oth'), proto languages (without code_iso),
+    # ancient languages, listed doculects, and those with too few meanings or without geometry
+    doculects = [d for d in doculects if is_doculect_included(d)]
     print('After filtering:')
     print_doculects_info(doculects)
 
     if os.path.exists(temperature_data):
-        with open(temperature_data, 'r') as f:
-            next(f)
-            lines = [line for line in f if '--' not in line]
-        names = [line.split(',')[0] for line in lines]
+        names = read_names_with_temperature(temperature_data)
         doculects = [d for d in doculects if d.name in names]
         print('After removing doculects without temperature data:')
         print_doculects_info(doculects)
     return doculects
 
 
-def validate(doculects):
+def iter_filtered_doculects(doculects, words_to_include=None, temperature_data=''):
+    # Streaming version of filter_doculects(). Doculects are not modified, but copied when
+    # intersected with words_to_include. Info of each step is printed when doculects are exhausted.
+    names = read_names_with_temperature(temperature_data) if os.path.exists(temperature_data) else None
+    infos = [DoculectsInfo() for _ in range(4)]
+    for d in doculects:
+        infos[0].add(d)
+        if words_to_include:
+            d = dataclasses.replace(d, synsets=[s for s in d.synsets if s.meaning in words_to_include])
+            infos[1].add(d)
+        if not is_doculect_included(d):
+            continue
+        infos[2].add(d)
+        if names is not None:
+            if d.name not in names:
+                continue
+            infos[3].add(d)
+        yield d
+    infos[0].print()
+    if words_to_include:
+        print(f'After intersection with {len(words_to_include)}:')
+        infos[1].print()
+    print('After filtering:')
+    infos[2].print()
+    if names is not None:
+        print('After removing doculects without temperature data:')
+        infos[3].print()
+
+
+def iter_batches(iterable, batch_size):
+    batch = []
+    for i in iterable:
+        batch.append(i)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_scored_doculects(doculects, average_by_meaning, with_loan, statistics=None, batch_size=1000, merge_vowels=False, workers=None):
+    # Yields (doculect, row of get_all_measures()), scoring doculects in batches.
+    # With statistics (from scan_corpus()), these are updated with each batch.
+    for batch in iter_batches(doculects, batch_size):
+        if statistics is not None:
+            scan_corpus(batch, statistics)
+        measures = get_all_measures(batch, average_by_meaning, with_loan,
+                                    merge_vowels=merge_vowels, workers=workers)
+        yield from zip(batch, measures)
+
+
+def scan_corpus(doculects, statistics=None):
+    # Validation report, phone counts, word structures and word length groups in one pass over all words.
+    # With statistics from a previous scan, these are updated and returned.
+    table = get_phone_table()
+    if statistics is None:
+        statistics = {'report': [], 'phone_counts': {}, 'word_structures': {}}
+    report = statistics['report']
+    phone_counts = statistics['phone_counts']
+    structures = statistics['word_structures']
     for doculect in doculects:
+        ids = set()
         for synset in doculect.synsets:
             for word in synset.words:
-                for phone in word2phones(word.form):
-                    base = phone2base_and_tags(phone)[0]
-                    if len(phone) == 0 or \
-                            len(base) == 0 or \
-                            [i for i in base if i not in token2type]:
-                        print(doculect.name, 'has invalid word:', word)
-        tags = [i
-                for synset in doculect.synsets
-                for word in synset.words
-                for phone in word2phones(word.form)
-                for i in phone2base_and_tags(phone)[1]]
-        tags = list(set(tags))
+                phones = word2phones(word.form)
+                word_ids = table.phones2ids(phones)
+                for phone, i in zip(phones, word_ids):
+                    phone_counts[phone] = phone_counts.get(phone, 0) + 1
+                    if not table.valid[i]:
+                        report.append(f'{doculect.name} has invalid word: {word}')
+                ids.update(word_ids)
+                structure = ''.join(['V' if i[0] in VOWELS else 'C' for i in phones])
+                structures[structure] = structures.get(structure, 0) + 1
+        tags = list(set([t for i in ids for t in table.tags[i]]))
         if 'vowel' not in tags:
-            print(doculect.name, 'has no vowel! Tags:', tags)
+            report.append(f'{doculect.name} has no vowel! Tags: {tags}')
         if 'consonant' not in tags:
-            print(doculect.name, 'has no consonant! Tags:', tags)
+            report.append(f'{doculect.name} has no consonant! Tags: {tags}')
+    statistics['word_lengths'] = group_word_structures(structures)
+    return statistics
+
+
+def print_corpus_statistics(statistics):
+    for line in statistics['report']:
+        print(line)
+    print_phone_counts(statistics['phone_counts'])
+    print_word_structures(statistics['word_structures'])
+
+
+def validate(doculects):
+    for line in scan_corpus(doculects)['report']:
+        print(line)
+
+
+def iter_validated_doculects(doculects):
+    # Streaming version of validate(): doculects are passed through, and the report of all of them
+    # is printed when they are exhausted
+    statistics = scan_corpus([])
+    for d in doculects:
+        scan_corpus([d], statistics)
+        yield d
+    for line in statistics['report']:
+        print(line)
 
 
 def get_phone_counts(doculects):
-    result = {}
-    for doculect in doculects:
-        for synset in doculect.synsets:
-            for word in synset.words:
-                for phone in word2phones(word.form):
-                    result[phone] = result.get(phone, 0) + 1
-    print('Total types of phones:', len(result.keys()))
-    print('Counts of all phones:', sum(result.values()))
-    print()
+    result = scan_corpus(doculects)['phone_counts']
+    print_phone_counts(result)
     return result
 
 
-def get_word_structures(doculects):
-    result = {}
-    for doculect in doculects:
-        for synset in doculect.synsets:
-            for word in synset.words:
-                word = ''.join(['V' if i[0] in VOWELS else 'C'
-                                for i in word2phones(word.form)])
-                result[word] = result.get(word, 0) + 1
-    print('Total types of word structures:', len(result))
-    print('Counts of all words:', sum(result.values()))
+def print_phone_counts(phone_counts):
+    print('Total types of phones:', len(phone_counts.keys()))
+    print('Counts of all phones:', sum(phone_counts.values()))
     print()
+
+
+def get_word_structures(doculects):
+    result = scan_corpus(doculects)['word_structures']
+    print_word_structures(result)
     return result
 
 
-def write_word_structures(structures, word_structures_filename, word_lengths_filename):
+def print_word_structures(structures):
+    print('Total types of word structures:', len(structures))
+    print('Counts of all words:', sum(structures.values()))
+    print()
+
+
+def group_word_structures(structures):
+    grouped = {}
+    for s in structures:
+        l = len(s)
+        if l not in grouped:
+            grouped[l] = [0, 0, 0]  # count, Cs, Vs
+        grouped[l][0] += structures[s]
+        grouped[l][1] += s.count('C') * structures[s]
+        grouped[l][2] += s.count('V') * structures[s]
+    return grouped
+
+
+def write_word_structures(structures, word_structures_filename, word_lengths_filename, grouped=None):
     def get_ratio(cs, vs):
         return '%.2f' % (cs / vs) if vs else 'C-only'
 
@@ -148,14 +404,8 @@ def write_word_structures(structures, word_structures_filename, word_lengths_fil
     with open(word_structures_filename, 'w') as f:
         f.writelines([','.join(line) + '\n' for line in result])
 
-    grouped = {}
-    for s in structures:
-        l = len(s)
-        if l not in grouped:
-            grouped[l] = [0, 0, 0]  # count, Cs, Vs
-        grouped[l][0] += structures[s]
-        grouped[l][1] += s.count('C') * structures[s]
-        grouped[l][2] += s.count('V') * structures[s]
+    if grouped is None:
+        grouped = group_word_structures(structures)
     result = [['length', 'C-V ratio', 'count']]
     lines = [[
         k,
@@ -170,45 +420,122 @@ def write_word_structures(structures, word_structures_filename, word_lengths_fil
 
 
 def doculect2index(doculect, average_by_meaning, with_loan, is_word_length=False, use_lingpy_model=False, merge_vowels=False):
-    def word2value(word):
-        if is_word_length:
-            return len(word2phones(word, merge_vowels))
-        if use_lingpy_model:
-            return average([int(i) for i in tokens2class(word2phones(word, merge_vowels), 'art')])
-        return word2index(word, merge_vowels)
-    if average_by_meaning:
-        indices = []
-        for synset in doculect.synsets:
-            synset_indices = [word2value(word.form) for word in synset.words
-                              if with_loan or not word.loan]
-            if synset_indices:
-                indices.append(average(synset_indices))
+    corpus = Corpus([doculect2forms(doculect)], merge_vowels)
+    if is_word_length:
+        word_values = corpus.get_word_lengths()
+    elif use_lingpy_model:
+        word_values = corpus.get_word_values(get_lingpy_indices(corpus.table.phones))
     else:
-        indices = [word2value(word.form) for synset in doculect.synsets
-                   for word in synset.words if with_loan or not word.loan]
-    return average(indices)
+        # Indices in the scale set by set_token2index()
+        ids = np.unique(corpus.phone_ids)
+        phone_values = np.zeros(len(corpus.table))
+        phone_values[ids] = [phone2index(corpus.table.phones[i]) for i in ids]
+        word_values = corpus.get_word_values(phone_values)
+    return corpus.get_doculect_values(word_values, average_by_meaning, with_loan)[0]
+
+
+def doculect2forms(doculect):
+    # Compact form data of a doculect: [[(form, loan) of each word] of each synset]
+    return [[(word.form, word.loan) for word in synset.words] for synset in doculect.synsets]
+
+
+lingpy_indices = {}
+
+
+def get_lingpy_indices(phones):
+    for phone in phones:
+        if phone not in lingpy_indices:
+            lingpy_indices[phone] = int(tokens2class([phone], 'art')[0])
+    return np.array([lingpy_indices[phone] for phone in phones], dtype=float)
 
 
-def get_sonority_indices(doculects, average_by_meaning, with_loan, scale_no, index_for_click=None, merge_vowels=False):
-    set_token2index(scale_no, index_for_click)
-    return [doculect2index(d, average_by_meaning, with_loan, merge_vowels=merge_vowels) for d in doculects]
+def get_word_values(corpus, measure, indices_for_click=None):
+    # measure: 'sonority' (all scales), 'lingpy', 'length' or 'all' (all scales, then LingPy index and word length)
+    if measure == 'length':
+        return corpus.get_word_lengths()
+    if measure == 'lingpy':
+        return corpus.get_word_values(get_lingpy_indices(corpus.table.phones))
+    phone_values = corpus.get_phone_values(get_phone_table(indices_for_click))
+    if measure == 'sonority':
+        return corpus.get_word_values(phone_values)
+    phone_values = np.column_stack((phone_values, get_lingpy_indices(corpus.table.phones)))
+    return np.column_stack((corpus.get_word_values(phone_values), corpus.get_word_lengths()))
 
 
-def get_sonority_indices_lingpy_model(doculects, average_by_meaning, with_loan, merge_vowels=False):
-    return [doculect2index(d, average_by_meaning, with_loan, use_lingpy_model=True, merge_vowels=merge_vowels) for d in doculects]
+def score_forms(forms, average_by_meaning, with_loan, measure, indices_for_click=None, merge_vowels=False):
+    corpus = Corpus(forms, merge_vowels)
+    return corpus.get_doculect_values(get_word_values(corpus, measure, indices_for_click),
+                                      average_by_meaning, with_loan)
 
 
-def get_word_lengths(doculects, average_by_meaning, with_loan, merge_vowels=False):
-    return [doculect2index(d, average_by_meaning, with_loan, is_word_length=True, merge_vowels=merge_vowels) for d in doculects]
+def score_doculects(doculects, average_by_meaning, with_loan, measure, indices_for_click=None, merge_vowels=False, workers=None):
+    # With workers, doculects are scored in a process pool. Only the compact form data are sent to
+    # the workers, in chunks, and results are returned in the original order.
+    forms = [doculect2forms(d) for d in doculects]
+    args = (average_by_meaning, with_loan, measure, indices_for_click, merge_vowels)
+    if not workers or len(forms) < 2:
+        return score_forms(forms, *args)
+    chunk_size = -(-len(forms) // (workers * 4))
+    chunks = [forms[i:i + chunk_size] for i in range(0, len(forms), chunk_size)]
+    with ProcessPoolExecutor(workers) as executor:
+        return np.concatenate(list(executor.map(score_forms, chunks, *[repeat(i) for i in args])))
 
 
-def get_all_sonority_indices(doculects, average_by_meaning, with_loan, indices_for_click=None, merge_vowels=False):
-    scale_nos = range(len(sonority_scales[0][1]))
-    if not indices_for_click:
-        indices_for_click = [None for _ in scale_nos]
-    return [get_sonority_indices(doculects, average_by_meaning, with_loan,
-                                 scale_no, indices_for_click[scale_no], merge_vowels)
-            for scale_no in scale_nos]
+def get_all_measures(doculects, average_by_meaning, with_loan, indices_for_click=None, merge_vowels=False, workers=None):
+    # Returns a (doculect x measure) matrix in a single pass over the words.
+    # Columns: one for each scale in sonority_scales, then the LingPy index and the mean word length.
+    # Scale values are read from a phone table instead of token2index, so this is thread-safe.
+    return score_doculects(doculects, average_by_meaning, with_loan, 'all',
+                           indices_for_click, merge_vowels, workers).reshape(len(doculects), SCALE_COUNT + 2)
+
+
+def get_sonority_indices(doculects, average_by_meaning, with_loan, scale_no, index_for_click=None, merge_vowels=False, workers=None):
+    indices_for_click = [index_for_click if i == scale_no else None for i in range(SCALE_COUNT)]
+    return list(score_doculects(doculects, average_by_meaning, with_loan, 'sonority',
+                                indices_for_click, merge_vowels, workers).reshape(len(doculects), SCALE_COUNT)[:, scale_no])
+
+
+def get_sonority_indices_lingpy_model(doculects, average_by_meaning, with_loan, merge_vowels=False, workers=None):
+    return list(score_doculects(doculects, average_by_meaning, with_loan, 'lingpy',
+                                merge_vowels=merge_vowels, workers=workers))
+
+
+def get_word_lengths(doculects, average_by_meaning, with_loan, merge_vowels=False, workers=None):
+    return list(score_doculects(doculects, average_by_meaning, with_loan, 'length',
+                                merge_vowels=merge_vowels, workers=workers))
+
+
+def get_all_sonority_indices(doculects, average_by_meaning, with_loan, indices_for_click=None, merge_vowels=False, workers=None):
+    indices = score_doculects(doculects, average_by_meaning, with_loan, 'sonority',
+                              indices_for_click, merge_vowels, workers).reshape(len(doculects), SCALE_COUNT)
+    return [list(i) for i in indices.T]
+
+
+def get_scale_sweep(doculects, row_values, average_by_meaning, with_loan, merge_vowels=False):
+    # Sonority indices of doculects (doculect x candidate) for many candidate scales at once.
+    # row_values: indices of each line of sonority_scales (line x candidate), see get_row_values().
+    # Doculect indices are linear in indices of phones, so each candidate is a matrix product.
+    corpus = Corpus([doculect2forms(d) for d in doculects], merge_vowels)
+    weights = corpus.get_phone_weights(average_by_meaning, with_loan)
+    phone_values = corpus.table.get_values(np.asarray(row_values, dtype=float))
+    result = weights @ phone_values
+    # Doculects without words to average
+    result[np.asarray(weights.sum(1)).flatten() == 0] = np.nan
+    return result
+
+
+def get_click_candidates(scale_no, indices_for_click):
+    # Row values of a scale with each of the given indices for clicks
+    row_values = np.repeat(get_row_values([scale_no]), len(indices_for_click), 1)
+    row_values[token2row['!']] = indices_for_click
+    return row_values
+
+
+def write_scale_sweep(doculects, sweep, candidate_names, csv_filename):
+    result = [['doculect name'] + list(candidate_names)]
+    result += [[d.name] + ['%.4f' % v for v in sweep[i]] for i, d in enumerate(doculects)]
+    with open(csv_filename, 'w') as f:
+        f.writelines([','.join(line) + '\n' for line in result])
 
 
 def get_geometries(doculects):
@@ -216,20 +543,38 @@ def get_geometries(doculects):
 
 
 def write_geometries_and_indices(doculects, all_sonority_indices, word_lengths, geometries, csv_filename):
-    result = [['doculect name', 'longitude', 'latitude', 'classification', 'meaning count', 'word count', 'mean word length'] +
-              ['index' + str(i) for i in range(len(all_sonority_indices))]]
-    result += [
-        [
-            doculects[i].name,
-            str(geometries[i][0]),
-            str(geometries[i][1]),
-            doculects[i].classification_wals,
-            str(len(doculects[i].synsets)),
-            str(sum([len(synset.words) for synset in doculects[i].synsets])),
-            '%.4f' % word_lengths[i],
-        ] +
-        ['%.4f' % sonority_indices[i]
-            for sonority_indices in all_sonority_indices]
-        for i, _ in enumerate(doculects)]
+    write_doculect_lines(
+        len(all_sonority_indices),
+        [doculect2line(d, [i[j] for i in all_sonority_indices], word_lengths[j], geometries[j])
+         for j, d in enumerate(doculects)],
+        csv_filename)
+
+
+def write_scored_doculects(scored_doculects, csv_filename):
+    # Writes (doculect, row of get_all_measures()) as they come, in the format of write_geometries_and_indices()
+    write_doculect_lines(
+        SCALE_COUNT + 1,
+        (doculect2line(d, measures[:-1], measures[-1], (d.longitude, d.latitude))
+         for d, measures in scored_doculects),
+        csv_filename)
+
+
+def doculect2line(doculect, sonority_indices, word_length, geometry):
+    return [
+        doculect.name,
+        str(geometry[0]),
+        str(geometry[1]),
+        doculect.classification_wals,
+        str(len(doculect.synsets)),
+        str(sum([len(synset.words) for synset in doculect.synsets])),
+        '%.4f' % word_length,
+    ] + ['%.4f' % i for i in sonority_indices]
+
+
+def write_doculect_lines(index_count, lines, csv_filename):
+    header = ['doculect name', 'longitude', 'latitude', 'classification', 'meaning count', 'word count', 'mean word length'] + \
+        ['index' + str(i) for i in range(index_count)]
     with open(csv_filename, 'w') as f:
-        f.writelines([','.join(line) + '\n' for line in result])
+        f.write(','.join(header) + '\n')
+        for line in lines:
+            f.write(','.join(line) + '\n')
@@ -1,8 +1,13 @@
 import get_temperature_lib as lib
 from sys import argv
 
-path = argv[1]
+if __name__ == '__main__':  # Required for reading files in worker processes
+    path = argv[1]
+    workers = int(argv[2]) if len(argv) > 2 else None
 
-names, geometries = lib.read_names_and_geometries('data/sonorities.csv')
-temperatures = lib.get_temperatures_by_geometries(path, geometries, True)
-lib.write_temperatures_by_doculects(names, geometries, temperatures, 'data/temperatures.csv')
+    names, geometries = lib.read_names_and_geometries('data/sonorities.csv')
+    # Only months and points not in the store yet are read, from all years in path
+    temperatures = lib.update_temperatures_store(path, 'data/temperatures_cube', names, geometries, True, workers=workers)
+    # Also as text (41 years only), read by get_sonority.py and plot_global.py (process.py reads the store if present)
+    temperatures = lib.select_years(temperatures, range(1982, 2023))
+    lib.write_temperatures_by_doculects(names, geometries, temperatures, 'data/temperatures.csv')
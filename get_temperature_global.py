@@ -1,29 +1,26 @@
 from time import time
 import get_temperature_lib as lib
 import numpy as np
+from array_store_lib import write_arrays
 from sys import argv
 
-path = argv[1]
+if __name__ == '__main__':  # Required for reading files in worker processes
+    write_csv = '--csv' in argv  # The text grid is large, so it is written only if asked
+    args = [i for i in argv[1:] if i != '--csv']
+    path = args[0]
+    workers = int(args[1]) if len(args) > 1 else None
 
-# Get data of 1982 Jan to see filter points without temperature
-condition = np.full((1500, 3600), True)
-temperatures = lib.get_temperatures_by_condition(path, condition, False, range(1982, 1983), range(1, 2))
-# Lines with temperature
-idxs = ~temperatures.values.mask.flatten()
-points = np.extract(np.stack((idxs, idxs), axis=-1), temperatures.points).reshape(-1, 2)
-
-for i in range(41):
+    # Statistics of all points having temperature in 1982 Jan, saved every year to resume from if interrupted
     s = time()
-    year = 1982 + i
-    temperatures_i = lib.get_temperatures_by_points(path, points, False, range(year, year + 1))
-    if i == 0:
-        temperatures = temperatures_i
-    else:
-        temperatures.values += temperatures_i.values
-    print(f'Read {year} done,', round(time() - s, 2), 's')
+    climatology = lib.get_climatology(path, checkpoint_dir='data/temperature_global_checkpoint', workers=workers)
+    print(f'Read done,', round(time() - s, 2), 's')
     print()
 
-temperatures.values /= 41
-s = time()
-lib.write_temperatures_by_points_global(temperatures, 'data/temperature_global.csv')
-print(f'Write done,', round(time() - s, 2), 's')
+    statistics = climatology.get_statistics()
+    s = time()
+    lib.write_values_by_points_global(climatology.points, statistics['T'], 'data/temperature_global.npz')
+    if write_csv:
+        lib.write_values_by_points_global(climatology.points, statistics['T'], 'data/temperature_global.csv')
+    write_arrays('data/temperature_global_statistics', dict(
+        [('points', climatology.points)] + [(k, v.filled(np.nan)) for k, v in statistics.items()]))
+    print(f'Write done,', round(time() - s, 2), 's')
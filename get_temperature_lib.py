@@ -1,15 +1,54 @@
+import os
 import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from netCDF4 import Dataset
+from scipy import sparse
 from pathlib import Path
+from array_store_lib import write_arrays, read_meta, read_arrays
+from temperature_store_lib import Temperatures, select_years, read_temperatures_store, write_global_grid, read_global_grid
 
 BUF_SIZE = 20 * 1024 * 1024  # 20 MB
+NEIGHBOR_RADIUS = 5  # Max distance (in grid cells) of neighbors for points without climate data
+EARTH_RADIUS = 6371.0  # km
 
 
-class Temperatures:
-    def __init__(self, year_months, points, values):
-        self.year_months = year_months
+class Climatology:
+    # Online statistics of the temperatures of points, updated one month at a time:
+    # count, mean, m2: count and mean of values, and sum of squared differences from the mean (Welford's algorithm)
+    # monthly_sums, monthly_counts: sums and counts of values of each calendar month (month x point)
+    def __init__(self, points):
         self.points = points
-        self.values = values
+        self.year_months = []
+        self.count = np.zeros(len(points), dtype=np.int32)
+        self.mean = np.zeros(len(points))
+        self.m2 = np.zeros(len(points))
+        self.monthly_sums = np.zeros((12, len(points)))
+        self.monthly_counts = np.zeros((12, len(points)), dtype=np.int32)
+
+    def add(self, year_month, values):
+        valid = ~np.ma.getmaskarray(values)
+        values = np.ma.getdata(values).astype(float)
+        self.count += valid
+        delta = np.where(valid, values - self.mean, 0)
+        self.mean += delta / np.maximum(self.count, 1)
+        self.m2 += delta * np.where(valid, values - self.mean, 0)
+        self.monthly_sums[year_month[1] - 1] += np.where(valid, values, 0)
+        self.monthly_counts[year_month[1] - 1] += valid
+        self.year_months.append(tuple(year_month))
+
+    def get_statistics(self):
+        # Same as process_lib.process_temperature() for each point; masked for points without data
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_monthly = self.monthly_sums / self.monthly_counts
+            result = {
+                'T': self.mean,
+                'T_max': mean_monthly.max(0),
+                'T_min': mean_monthly.min(0),
+                'T_sd': np.sqrt(self.m2 / self.count),
+            }
+        result['T_diff'] = result['T_max'] - result['T_min']
+        return dict([(k, np.ma.array(v, mask=(self.count == 0) | np.isnan(v))) for k, v in result.items()])
 
 
 def coord_2_point(coord):  # coord: (lon, lat)
@@ -23,6 +62,36 @@ def coord_2_point(coord):  # coord: (lon, lat)
     return round((lon + 179.95) * 10), round((lat + 59.95) * 10)
 
 
+def coords_2_points(coords):  # coords: (n x 2) array of (lon, lat)
+    # Same as coord_2_point() for each coord, returned as an (n x 2) array of (x, y)
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2) * 10
+    return np.trunc(coords - (coords < 0)).astype(np.int64) + [1800, 600]
+
+
+class PointIndex:
+    # Sorted linear indices (y * 3600 + x) of points, to find the rows of many points at once
+    def __init__(self, points):
+        keys = get_point_keys(points)
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get_rows(self, points):
+        # Row of each of points in the points of the index; -1 for points not in it
+        keys = get_point_keys(points)
+        if not len(self):
+            return np.full(len(keys), -1)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self) - 1)
+        return np.where(self.keys[pos] == keys, self.order[pos], -1)
+
+
+def get_point_keys(points):
+    points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+    return points[:, 1] * 3600 + points[:, 0]
+
+
 def read_names_and_geometries(csv_filename):
     with open(csv_filename, 'r') as f:
         next(f)
@@ -30,62 +99,354 @@ def read_names_and_geometries(csv_filename):
         return [line[0] for line in data], [(float(line[1]), float(line[2])) for line in data]
 
 
-def get_temperatures_by_geometries(path, geometries, use_neighbors=True, year_range=range(1982, 2023), month_range=range(1, 13), param='Tair_f_tavg'):
-    points = set([coord_2_point(i) for i in geometries])
+def get_temperatures_by_geometries(path, geometries, use_neighbors=True, year_range=range(1982, 2023), month_range=range(1, 13), param='Tair_f_tavg', workers=None, radius_km=None, kernel='uniform'):
+    points = np.unique(coords_2_points(geometries), axis=0)
     return get_temperatures_by_points(path, points,
-                                      use_neighbors, year_range, month_range, param)
+                                      use_neighbors, year_range, month_range, param, workers,
+                                      radius_km=radius_km, kernel=kernel)
 
 
-def get_temperatures_by_points(path, points, use_neighbors=True, year_range=range(1982, 2023), month_range=range(1, 13), param='Tair_f_tavg'):
+def get_temperatures_by_points(path, points, use_neighbors=True, year_range=range(1982, 2023), month_range=range(1, 13), param='Tair_f_tavg', workers=None, year_months=None, radius_km=None, kernel='uniform'):
+    points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
     condition = np.full((1500, 3600), False)
-    for point in points:
-        condition[point[1]][point[0]] = True
+    condition[points[:, 1], points[:, 0]] = True
     return get_temperatures_by_condition(path, condition,
-                                         use_neighbors, year_range, month_range, param)
+                                         use_neighbors, year_range, month_range, param, workers=workers,
+                                         year_months=year_months, radius_km=radius_km, kernel=kernel)
 
 
-def get_temperatures_by_condition(path, condition, use_neighbors=True, year_range=range(1982, 2023), month_range=range(1, 13), param='Tair_f_tavg'):
+def get_temperatures_by_condition(path, condition, use_neighbors=True, year_range=range(1982, 2023), month_range=range(1, 13), param='Tair_f_tavg', read_mode='rows', workers=None, year_months=None, radius_km=None, kernel='uniform'):
+    # read_mode: 'rows' reads only rows of the grid having points (or their neighbors);
+    # 'full' reads whole files into memory and decodes full grids
+    # workers: number of processes reading month files concurrently
+    # year_months: (year, month) pairs to read instead of year_range x month_range
+    # param: a variable, or a list of variables, all read from one open of each file and returned
+    #   as a dict of Temperatures (values in kelvins are converted to degrees Celsius)
+    # radius_km: if given, each point takes the mean of cells with data within radius_km of it
+    #   (weighted by kernel, see get_kernel_weights) instead of its own cell or neighbor;
+    #   points without such cells are masked
+    params = [param] if isinstance(param, str) else list(param)
     # Rebuild list of points from condition matrix
     points = np.where(condition)
     points = np.array([points[1], points[0]]).T
+    margin = get_kernel_margin(radius_km) if radius_km else NEIGHBOR_RADIUS if use_neighbors else 0
+    rows = get_rows_to_read(points, margin) if read_mode == 'rows' else np.arange(1500)
+    # Position of each row of the grid in the rows read
+    row_pos = np.full(1500, -1)
+    row_pos[rows] = np.arange(len(rows))
 
+    if year_months is None:
+        year_months = [(year, month) for year in year_range for month in month_range]
+    filenames = [get_fldas_filename(path, *ym) for ym in year_months]
+    # Cells (in the rows read) to take values of points from
+    cells = (row_pos[points[:, 1]], points[:, 0])
+    if radius_km:
+        cells = get_kernel_weights(points, row_pos, radius_km, kernel)
+    elif use_neighbors and filenames:
+        # The land mask does not change between months (or variables), so neighbors are found
+        # in the first month of the first variable
+        mask = np.ma.getmaskarray(read_grid(filenames[0], params[0], rows, read_mode))
+        cells = get_neighbor_cells(mask, points, row_pos)
     dct = {}
-    for year in year_range:
-        for month in month_range:
-            ym = (year, month)
-            filename = Path(path) \
-                / ('%d' % year) \
-                / ('FLDAS_NOAH01_C_GL_M.A%d%02d.001.nc' % (year, month))
-            with open(filename, 'rb') as f:
-                b = f.read()
-            nc = Dataset('/', memory=b)
-            data = nc[param][0]
-            nc.close()
-            dct[ym] = np.extract(condition, data)
-
-            # For points without climate data, try neighbors
-            if use_neighbors:
-                idxs = np.where(dct[ym] == np.ma.masked)[0]
-                for i in idxs:
-                    x, y = points[i][0], points[i][1]
-                    for offset in range(1, 6):
-                        neighbors = [[
-                            (x - offset, y + d),
-                            (x + d, y - offset),
-                            (x + offset, y + d),
-                            (x + d, y + offset),
-                        ] for d in range(-offset, offset + 1)]
-                        neighbors = set([p for l in neighbors for p in l])
-                        for p in neighbors:
-                            v = data[p[1] % 1500][p[0] % 3600]
-                            if not np.ma.is_masked(v):
-                                break
-                        if not np.ma.is_masked(v):
-                            dct[ym][i] = v
-                            break
-            dct[ym] = np.round(dct[ym] - 273.15, 3)
-            print('%d/%d' % (year, month), 'done')
-    return Temperatures(list(dct.keys()), points, np.ma.array(list(dct.values())).T)
+    for ym, values in zip(year_months, imap_ordered(
+            read_month, filenames, workers, param=params, rows=rows, cells=cells, read_mode=read_mode)):
+        dct[ym] = values
+        print('%d/%d' % ym, 'done')
+    result = dict([(p, Temperatures(list(dct.keys()), points, np.ma.array([v[i] for v in dct.values()]).T))
+                   for i, p in enumerate(params)])
+    return result[param] if isinstance(param, str) else result
+
+
+def get_climatology(path, points=None, year_range=range(1982, 2023), month_range=range(1, 13), param='Tair_f_tavg', checkpoint_dir=None, checkpoint_every=12, workers=None):
+    # Reads each month file once, adding its values to the statistics of points (by default,
+    # all points having data in the first month).
+    # With checkpoint_dir, the statistics are saved every checkpoint_every months, and a run
+    # with the same arguments resumes from the last save.
+    year_months = [(year, month) for year in year_range for month in month_range]
+    # Saves of runs of other paths or months are not resumed from
+    run = {'path': os.path.abspath(path), 'year_months': [list(ym) for ym in year_months]}
+    climatology = read_climatology_checkpoint(checkpoint_dir, param, points, run) if checkpoint_dir else None
+    if climatology is None:
+        if points is None:
+            mask = np.ma.getmaskarray(read_grid_rows(get_fldas_filename(path, *year_months[0]), param, np.arange(1500)))
+            points = np.where(~mask)
+            points = np.array([points[1], points[0]]).T
+        climatology = Climatology(np.asarray(points))
+    done = set(climatology.year_months)
+    year_months = [ym for ym in year_months if ym not in done]
+    points = climatology.points
+    rows = np.unique(points[:, 1])
+    row_pos = np.full(1500, -1)
+    row_pos[rows] = np.arange(len(rows))
+    cells = (row_pos[points[:, 1]], points[:, 0])
+    filenames = [get_fldas_filename(path, *ym) for ym in year_months]
+    for i, (ym, values) in enumerate(zip(year_months, imap_ordered(
+            read_month, filenames, workers, param=param, rows=rows, cells=cells))):
+        climatology.add(ym, values)
+        print('%d/%d' % ym, 'done')
+        if checkpoint_dir and ((i + 1) % checkpoint_every == 0 or i + 1 == len(year_months)):
+            write_climatology_checkpoint(climatology, checkpoint_dir, param, run)
+    return climatology
+
+
+def write_climatology_checkpoint(climatology: Climatology, dirname, param, run=None):
+    # Saves go to two slots in turn (the one not saved to last), so an interrupted save leaves the
+    # previous one readable. run: JSON data identifying the run (see read_climatology_checkpoint)
+    slots = [os.path.join(dirname, slot) for slot in ('0', '1')]
+    saves = [(read_meta(slot) or {}).get('save', -1) for slot in slots]
+    write_arrays(slots[int(saves[0] > saves[1])], {
+        'points': climatology.points,
+        'count': climatology.count,
+        'mean': climatology.mean,
+        'm2': climatology.m2,
+        'monthly_sums': climatology.monthly_sums,
+        'monthly_counts': climatology.monthly_counts,
+    }, {'param': param, 'run': run, 'save': max(saves) + 1, 'year_months': climatology.year_months})
+
+
+def read_climatology_checkpoint(dirname, param, points=None, run=None):
+    # Returns the latest save for param and run (and points, if given), or None
+    slots = [os.path.join(dirname, slot) for slot in ('0', '1')]
+    metas = [read_meta(slot) for slot in slots]
+    slots = [(meta.get('save', -1), slot) for slot, meta in zip(slots, metas)
+             if meta is not None and meta['param'] == param and meta.get('run') == run]
+    if not slots:
+        return None
+    arrays, meta = read_arrays(max(slots)[1], None)
+    if points is not None and not np.array_equal(arrays['points'], points):
+        return None
+    climatology = Climatology(arrays['points'])
+    for name in ('count', 'mean', 'm2', 'monthly_sums', 'monthly_counts'):
+        setattr(climatology, name, arrays[name])
+    climatology.year_months = [tuple(ym) for ym in meta['year_months']]
+    return climatology
+
+
+def update_temperatures_store(path, dirname, names, geometries, use_neighbors=True, year_range=None, month_range=range(1, 13), param='Tair_f_tavg', workers=None):
+    # Extracts temperatures of geometries to the store in dirname (see write_temperatures_store), reading
+    # only months not extracted yet (or whose files changed) and points not in the store yet.
+    # year_range: years to extract, by default all years having files in path
+    year_months = get_year_months(path, year_range, month_range)
+    fingerprints = dict([('%d/%d' % ym, get_file_fingerprint(get_fldas_filename(path, *ym))) for ym in year_months])
+    meta = read_meta(dirname)
+    if meta is not None and meta.get('param') == param and meta.get('use_neighbors') == use_neighbors:
+        old = read_temperatures_store(dirname, None)
+        old_fingerprints = meta['fingerprints']
+    else:
+        old = Temperatures([], np.zeros((0, 2), dtype=np.int32), np.ma.masked_all((0, 0)))
+        old_fingerprints = {}
+    # Months are kept unless their files have changed; months without files now are kept as well
+    kept = [i for i, ym in enumerate(old.year_months)
+            if fingerprints.get('%d/%d' % ym, old_fingerprints['%d/%d' % ym]) == old_fingerprints['%d/%d' % ym]]
+    new_year_months = [ym for ym in year_months if ym not in set([old.year_months[i] for i in kept])]
+    points = np.unique(coords_2_points(geometries), axis=0)
+    new_points = points[PointIndex(old.points).get_rows(points) < 0]
+
+    all_year_months = sorted([old.year_months[i] for i in kept] + new_year_months)
+    columns = dict([(ym, i) for i, ym in enumerate(all_year_months)])
+    # Points in the store keep their rows, and new points are appended
+    if len(new_points):
+        new = get_temperatures_by_points(path, new_points, use_neighbors, param=param, workers=workers,
+                                         year_months=[ym for ym in all_year_months if '%d/%d' % ym in fingerprints])
+        all_points = np.concatenate((old.points, new.points)).astype(np.int32)
+    else:
+        all_points = old.points
+    values = np.ma.masked_all((len(all_points), len(all_year_months)))
+    values[:len(old.points), [columns[old.year_months[i]] for i in kept]] = old.values[:, kept]
+    if new_year_months and len(old.points):
+        added = get_temperatures_by_points(path, old.points, use_neighbors, param=param, workers=workers,
+                                           year_months=new_year_months)
+        values[:len(old.points), [columns[ym] for ym in new_year_months]] = \
+            added.values[get_point_rows(added.points, old.points)]
+    if len(new_points):
+        values[len(old.points):, [columns[ym] for ym in new.year_months]] = new.values
+    print('Kept %d months of %d points; read %d new months and %d new points'
+          % (len(kept), len(old.points), len(new_year_months), len(new_points)))
+
+    temperatures = Temperatures(all_year_months, all_points, values, list(names))
+    temperatures.doculect_points = np.array(get_doculect_points(temperatures, geometries), dtype=np.int64)
+    old_fingerprints.update(fingerprints)
+    write_temperatures_store(temperatures, dirname, names, geometries, {
+        'param': param,
+        'use_neighbors': use_neighbors,
+        'fingerprints': dict([('%d/%d' % ym, old_fingerprints['%d/%d' % ym]) for ym in all_year_months]),
+    })
+    return temperatures
+
+
+def get_neighbor_cells(mask, points, row_pos):
+    # For points without climate data (masked), take the first unmasked neighbor in the nearest ring
+    cell_rows = row_pos[points[:, 1]]
+    cell_cols = points[:, 0].copy()
+    for i in np.where(mask[cell_rows, cell_cols])[0]:
+        x, y = points[i][0], points[i][1]
+        for offset in range(1, NEIGHBOR_RADIUS + 1):
+            neighbors = [[
+                (x - offset, y + d),
+                (x + d, y - offset),
+                (x + offset, y + d),
+                (x + d, y + offset),
+            ] for d in range(-offset, offset + 1)]
+            neighbors = set([p for l in neighbors for p in l])
+            cell = next(((row_pos[p[1] % 1500], p[0] % 3600) for p in neighbors
+                         if not mask[row_pos[p[1] % 1500], p[0] % 3600]), None)
+            if cell:
+                cell_rows[i], cell_cols[i] = cell
+                break
+    return cell_rows, cell_cols
+
+
+def get_kernel_margin(radius_km):
+    # Grid rows (of 0.1 degrees of latitude) within radius_km
+    return int(np.ceil(radius_km / (EARTH_RADIUS * np.pi / 1800)))
+
+
+def get_kernel_weights(points, row_pos, radius_km, kernel='uniform'):
+    # Sparse (point x cell) matrix of weights of cells (in the rows read, flattened) within radius_km
+    # of each point, by great-circle distance between cell centers.
+    # kernel: 'uniform' for equal weights; 'gaussian' for weights exp(-d^2 / 2s^2), where s = radius_km / 2
+    dy = get_kernel_margin(radius_km)
+    lats = np.radians((points[:, 1] - 600) * 0.1 + 0.05)
+    # Cells needed in each row are within the width at the latitude nearest to a pole
+    max_lats = np.minimum(np.abs(lats) + np.radians(dy * 0.1), np.radians(89.95))
+    dxs = np.minimum(np.ceil(dy / np.cos(max_lats)), 1799).astype(int)
+    point_ids, cell_ids, weights = [], [], []
+    for dx in np.unique(dxs):
+        group = np.where(dxs == dx)[0]
+        ox, oy = np.meshgrid(np.arange(-dx, dx + 1), np.arange(-dy, dy + 1))
+        xs = (points[group, 0:1] + ox.ravel()) % 3600
+        ys = points[group, 1:2] + oy.ravel()
+        inside = (ys >= 0) & (ys < 1500)
+        ys = np.clip(ys, 0, 1499)
+        lat = np.radians((ys - 600) * 0.1 + 0.05)
+        dlon = np.radians((xs - points[group, 0:1]) * 0.1)
+        dlat = lat - lats[group, None]
+        distances = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(
+            np.sin(dlat / 2) ** 2 + np.cos(lats[group, None]) * np.cos(lat) * np.sin(dlon / 2) ** 2))
+        inside &= distances <= radius_km
+        point_ids.append(np.broadcast_to(group[:, None], xs.shape)[inside])
+        cell_ids.append((row_pos[ys] * 3600 + xs)[inside])
+        if kernel == 'uniform':
+            weights.append(np.ones(inside.sum()))
+        elif kernel == 'gaussian':
+            weights.append(np.exp(-2 * (distances[inside] / radius_km) ** 2))
+        else:
+            raise ValueError(f'Unknown kernel: {kernel}')
+    return sparse.csr_matrix(
+        (np.concatenate(weights), (np.concatenate(point_ids), np.concatenate(cell_ids))),
+        shape=(len(points), int((row_pos >= 0).sum()) * 3600))
+
+
+def gather_cells(data, cells):
+    # cells: (rows, cols) of cells in data, or a sparse matrix of weights (see get_kernel_weights)
+    if not sparse.issparse(cells):
+        return data[cells]
+    valid = ~np.ma.getmaskarray(data).ravel()
+    sums = cells @ np.where(valid, np.ma.getdata(data).ravel(), 0)
+    counts = cells @ valid.astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.ma.array(sums / counts, mask=counts == 0)
+
+
+worker_kwargs = {}  # Set in each worker process of imap_ordered()
+
+
+def set_worker_kwargs(kwargs):
+    global worker_kwargs
+    worker_kwargs = kwargs
+
+
+def call_with_worker_kwargs(func, item):
+    return func(item, **worker_kwargs)
+
+
+def imap_ordered(func, items, workers=None, **kwargs):
+    # Yields func(item, **kwargs) for each item. With workers, items are processed in a process pool
+    # with at most 2 * workers items in flight, and kwargs (e.g. large arrays) are sent once to each
+    # worker when it starts, rather than with each item.
+    # Threads are not used as netCDF files cannot be read concurrently in a process.
+    if not workers:
+        yield from (func(item, **kwargs) for item in items)
+        return
+    with ProcessPoolExecutor(workers, initializer=set_worker_kwargs, initargs=(kwargs,)) as executor:
+        futures = deque()
+        for item in items:
+            futures.append(executor.submit(call_with_worker_kwargs, func, item))
+            if len(futures) >= 2 * workers:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+def read_month(filename, param, rows, cells, read_mode='rows'):
+    # param: a variable, or a list of variables to read from one open of the file
+    if isinstance(param, str):
+        return read_month(filename, [param], rows, cells, read_mode)[0]
+    return [convert_units(gather_cells(data, cells), units)
+            for data, units in read_grids(filename, param, rows, read_mode)]
+
+
+def convert_units(values, units):
+    if units == 'K':
+        return np.round(values - 273.15, 3)
+    return values
+
+
+def read_grid(filename, param, rows, read_mode='rows'):
+    return read_grids(filename, [param], rows, read_mode)[0][0]
+
+
+def read_grids(filename, params, rows, read_mode='rows'):
+    # Grids of params, with their units, from one open of the file
+    if read_mode == 'rows':
+        with Dataset(filename) as nc:
+            return [(read_var_rows(nc[param], rows), getattr(nc[param], 'units', None)) for param in params]
+    with open(filename, 'rb') as f:
+        b = f.read()
+    nc = Dataset('/', memory=b)
+    result = [(nc[param][0], getattr(nc[param], 'units', None)) for param in params]
+    nc.close()
+    return result
+
+
+def get_year_months(path, year_range=None, month_range=range(1, 13)):
+    # (year, month) of all FLDAS files in path, in order
+    year_months = []
+    for filename in Path(path).glob('*/FLDAS_NOAH01_C_GL_M.A*.001.nc'):
+        ym = filename.name.split('.')[1][1:]
+        year_months.append((int(ym[:4]), int(ym[4:])))
+    return sorted([ym for ym in year_months
+                   if (year_range is None or ym[0] in year_range) and ym[1] in month_range])
+
+
+def get_file_fingerprint(filename):
+    stat = os.stat(filename)
+    return '%d-%d' % (stat.st_size, stat.st_mtime_ns)
+
+
+def get_fldas_filename(path, year, month):
+    return Path(path) \
+        / ('%d' % year) \
+        / ('FLDAS_NOAH01_C_GL_M.A%d%02d.001.nc' % (year, month))
+
+
+def get_rows_to_read(points, margin=0):
+    # Rows of the grid having points, and rows within margin of them (wrapped as neighbors are)
+    rows = np.unique(points[:, 1])
+    return np.unique((rows.reshape(-1, 1) + np.arange(-margin, margin + 1)) % 1500)
+
+
+def read_grid_rows(filename, param, rows):
+    with Dataset(filename) as nc:
+        return read_var_rows(nc[param], rows)
+
+
+def read_var_rows(var, rows):
+    # Reads only the given rows (sorted) of the grid, as one hyperslab for each run of consecutive rows
+    runs = [run for run in np.split(rows, np.where(np.diff(rows) != 1)[0] + 1) if len(run)]
+    if not runs:
+        return np.ma.masked_all((0, var.shape[-1]), dtype=var.dtype)
+    return np.ma.concatenate([var[0, run[0]:run[-1] + 1] for run in runs])
 
 
 def comma_join(lst, do_round=False):
@@ -103,31 +464,65 @@ def write_temperatures_by_points(temperatures: Temperatures, csv_filename):
 
 
 def write_temperatures_by_points_global(temperatures: Temperatures, csv_filename):
-    vs = np.mean(temperatures.values, 1)
+    write_values_by_points_global(temperatures.points, np.mean(temperatures.values, 1), csv_filename)
+
+
+def write_values_by_points_global(points, values, filename):
+    # filename: .npz for a compressed binary grid (see read_global_grid), otherwise text
+    grid = get_global_grid(points, values)
+    if str(filename).endswith('.npz'):
+        write_global_grid(grid, filename)
+    else:
+        write_global_grid_text(grid, filename)
 
-    mat = np.ma.array(np.zeros((1500, 3600)), mask=np.full((1500, 3600), True))
-    for i, v in enumerate(vs):
-        x, y = temperatures.points[i]
-        mat[y][x] = v
+
+def get_global_grid(points, values):
+    grid = np.ma.array(np.zeros((1500, 3600)), mask=np.full((1500, 3600), True))
+    points = np.asarray(points).reshape(-1, 2)
+    grid[points[:, 1], points[:, 0]] = values
+    return grid
+
+
+def write_global_grid_text(grid, csv_filename):
+    # Same as comma_join(line, True) for each line
     with open(csv_filename, 'w', BUF_SIZE) as f:
-        for line in mat:
-            f.write(comma_join(line, True))
+        for line in grid:
+            text = ['%.3f' % v for v in line.data.tolist()]
+            for i in np.flatnonzero(np.ma.getmaskarray(line)):
+                text[i] = '--'
+            f.write(','.join(text) + '\n')
+
+
+def get_doculect_points(temperatures: Temperatures, geometries):
+    return get_point_rows(temperatures.points, coords_2_points(geometries))
+
+
+def get_point_rows(all_points, points):
+    # Row of each of points in all_points
+    rows = PointIndex(all_points).get_rows(points)
+    if (rows < 0).any():
+        raise KeyError('Points not found: %s' % np.asarray(points).reshape(-1, 2)[rows < 0][:5].tolist())
+    return rows
 
 
 def write_temperatures_by_doculects(names, geometries, temperatures: Temperatures, csv_filename):
     with open(csv_filename, 'w', BUF_SIZE) as f:
         f.write(comma_join(
             ['doculect name'] + ['%d/%d' % i for i in temperatures.year_months]))
+        for name, i in zip(names, get_doculect_points(temperatures, geometries)):
+            f.write(comma_join([name] + list(temperatures.values[i])))
+
 
-        def point_2_key(point):
-            return int(point[0] * 10000 + point[1])
-        index_dict = dict([(point_2_key(v), i)
-                           for i, v in enumerate(temperatures.points)])
-        for j, name in enumerate(names):
-            f.write(comma_join([name] +
-                               list(temperatures.values[
-                                   index_dict[
-                                       point_2_key(
-                                           coord_2_point(geometries[j]))
-                                   ]
-                               ])))
+def write_temperatures_store(temperatures: Temperatures, dirname, names=None, geometries=None, meta=None):
+    # Binary (point x year_month) cube, with doculect names and points if given (see read_temperatures_store)
+    arrays = {
+        'year_months': np.array(temperatures.year_months, dtype=np.int32).reshape(-1, 2),
+        'points': np.array(temperatures.points, dtype=np.int32).reshape(-1, 2),
+        'values': np.ma.getdata(temperatures.values).astype(float),
+        'mask': np.ma.getmaskarray(temperatures.values),
+    }
+    meta = dict(meta or {})
+    if names is not None:
+        arrays['doculect_points'] = np.array(get_doculect_points(temperatures, geometries), dtype=np.int64)
+        meta['names'] = list(names)
+    write_arrays(dirname, arrays, meta)
@@ -1,10 +1,14 @@
+import os
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.colors import ListedColormap
 import colorsys
+from temperature_store_lib import read_global_grid
 
 
 def read_global_temperature(filename):
+    if filename.endswith('.npz'):
+        return read_global_grid(filename)
     return np.genfromtxt(filename, delimiter=',', usemask=True)
 
 
@@ -31,7 +35,8 @@ def new_cmap(cm_object, saturation_factor, lightness_factor):
     return my_cmap
 
 
-t = read_global_temperature('data/temperature_global.csv')
+t = read_global_temperature('data/temperature_global.npz' if os.path.exists('data/temperature_global.npz')
+                            else 'data/temperature_global.csv')
 sx, sy, sv = read_sonorities('data/sonorities.csv', 'data/temperatures.csv')
 
 # plt.hist(t.flatten(), bins=30), plt.show()
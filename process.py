@@ -1,15 +1,23 @@
+import os
 import process_lib as lib
+from sys import argv
 
-data = lib.read_data('data/temperatures.csv', 'data/sonorities.csv')
-data_macroarea = lib.grouped_by(data, 'Macroarea')
-data_family = lib.grouped_by(data, 'Family')
-data_genus = lib.grouped_by(data, 'Genus')
-lib.transform_data(data)
-lib.transform_data(data_family)
-lib.transform_data(data_genus)
-lib.write_data(data, 'data/data.csv')
-lib.write_data(data_macroarea, 'data/data_macroarea.csv')
-lib.write_data(data_family, 'data/data_family.csv')
-lib.write_data(data_genus, 'data/data_genus.csv')
+if __name__ == '__main__':  # Required for fitting transforms in worker processes
+    workers = int(argv[1]) if len(argv) > 1 else None
 
-lib.plot_macroareas(data)
+    # Temperatures are read from the binary store of get_temperature.py if present
+    temperatures = 'data/temperatures_cube' if os.path.exists('data/temperatures_cube') else 'data/temperatures.csv'
+    data = lib.read_data(temperatures, 'data/sonorities.csv')
+    grouped = lib.grouped_by_keys(data, ['Macroarea', 'Family', 'Genus'])
+    data_macroarea = grouped['Macroarea']
+    data_family = grouped['Family']
+    data_genus = grouped['Genus']
+    lib.read_lambdas_cache('data/transform_lambdas.json')
+    lib.transform_levels([data, data_family, data_genus], workers)
+    lib.write_lambdas_cache('data/transform_lambdas.json')
+    lib.write_data(data, 'data/data.csv')
+    lib.write_data(data_macroarea, 'data/data_macroarea.csv')
+    lib.write_data(data_family, 'data/data_family.csv')
+    lib.write_data(data_genus, 'data/data_genus.csv')
+
+    lib.plot_macroareas(data)
@@ -1,12 +1,23 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 from time import time
 import numpy as np
-from scipy import stats
+from scipy import special, stats
 import matplotlib.pyplot as plt
 import statsmodels.formula.api as smf
 import geopandas
 from shapely.geometry import Point
 import matplotlib.cm as cm
-from sklearn.preprocessing import PowerTransformer
+from sklearn.preprocessing import PowerTransformer, StandardScaler
+from temperature_store_lib import read_temperatures_store
+from segments_lib import segment_means
+
+TEMPERATURE_KEYS = ['T', 'T_max', 'T_min', 'T_sd', 'T_diff']
+MACROAREAS = ['Pacific', 'SouthAmerica', 'NorthAmerica', 'Africa', 'Eurasia', 'Australia']
+lambdas_cache = {}  # Box-Cox lambdas by SHA-1 of columns; see get_box_cox_lambda()
+used_lambda_keys = set()  # Keys of lambdas used in this run; see write_lambdas_cache()
 
 
 def coord_2_macroarea(coord):  # coord: (lon, lat)
@@ -54,6 +65,66 @@ def coord_2_macroarea(coord):  # coord: (lon, lat)
     return 'Eurasia'
 
 
+def coords_2_macroareas(lons, lats, raster=None):
+    # coord_2_macroarea() of all coordinates at once, as an array of names.
+    # raster: codes from get_macroarea_raster(), to look coordinates up by their cells of the 0.1° grid.
+    #   As cells are classified by their centers, results may differ from the rules near borders.
+    return np.array(MACROAREAS)[coords_2_macroarea_codes(lons, lats, raster)]
+
+
+def coords_2_macroarea_codes(lons, lats, raster=None):
+    # Indices in MACROAREAS; see coords_2_macroareas()
+    x = np.asarray(lons, dtype=float)
+    y = np.asarray(lats, dtype=float)
+    if raster is not None:
+        # Cells as in get_temperature_lib.coords_2_points(); coordinates outside the grid are classified by the rules
+        cell_x = np.trunc(x * 10 - (x * 10 < 0)).astype(int) + 1800
+        cell_y = np.trunc(y * 10 - (y * 10 < 0)).astype(int) + 600
+        inside = (cell_x >= 0) & (cell_x < raster.shape[1]) & (cell_y >= 0) & (cell_y < raster.shape[0])
+        codes = np.empty(x.shape, dtype=raster.dtype)
+        codes[inside] = raster[cell_y[inside], cell_x[inside]]
+        codes[~inside] = coords_2_macroarea_codes(x[~inside], y[~inside])
+        return codes
+
+    def below(x1, y1, x2, y2):
+        return (x2 - x1) * (y - y1) <= (y2 - y1) * (x - x1)
+    # The rules of coord_2_macroarea(), in the same order
+    americas = (x <= -28) & below(-94, 86, -28, 46) | (x <= -28) & (y <= 46)
+    africa_or_eurasia = x <= 62
+    return np.select([
+        (x <= -168) | (x <= -98) & below(-168, 40, -98, 5) | (x <= -98) & (y <= 5),
+        americas & ((y <= 5) | (-80 < x) & (x <= -66) & (y <= 13) | (-66 < x) & (y <= 11)),
+        americas,
+        africa_or_eurasia & (
+            (x <= -3) & (y <= 36) |
+            (-3 < x) & (x <= 3) & below(-3, 36, 3, 38) |
+            (3 < x) & (x <= 11) & (y <= 38) |
+            (11 < x) & (x <= 13) & below(11, 38, 13, 34) |
+            (13 < x) & (x <= 30) & (y <= 34) |
+            (30 < x) & (x <= 44) & below(30, 34, 44, 11) |
+            (44 < x) & below(44, 11, 62, 17)),
+        africa_or_eurasia,
+        (x <= 127) & (y <= -13) |
+        (127 < x) & (x <= 145) & (y <= -10) |
+        (145 < x) & (x <= 162) & below(145, -10, 162, -30),
+        (x <= 97) & below(62, 0, 97, 6) |
+        (97 < x) & (x <= 104) & below(97, 6, 104, 0) |
+        (104 < x) & (x <= 120) & below(104, 0, 120, 22) |
+        (120 < x) & (x <= 123) & (y <= 26) |
+        (123 < x) & (y <= 22),
+    ], [
+        MACROAREAS.index(i) for i in
+        ['Pacific', 'SouthAmerica', 'NorthAmerica', 'Africa', 'Eurasia', 'Australia', 'Pacific']
+    ], MACROAREAS.index('Eurasia')).astype(np.uint8)
+
+
+def get_macroarea_raster():
+    # Macroarea codes (see coords_2_macroarea_codes()) of the centers of cells of the 0.1° grid
+    # of temperatures (1500 x 3600, from 60° S and 180° W)
+    y, x = np.mgrid[0:1500, 0:3600]
+    return coords_2_macroarea_codes((x - 1800) * 0.1 + 0.05, (y - 600) * 0.1 + 0.05)
+
+
 def transform(lst, title='', print_message=False, do_plot=False):
     lst = np.array(lst, dtype=float).reshape(-1, 1)
     bc = PowerTransformer(method='box-cox')
@@ -64,6 +135,8 @@ def transform(lst, title='', print_message=False, do_plot=False):
     lst_yj = yj.fit(lst).transform(lst).flatten()
     lambda_bc = round(bc.lambdas_[0], 2)
     lambda_yj = round(yj.lambdas_[0], 2)
+    if not print_message and not do_plot:
+        return lst_bc, lst_yj, lambda_bc, lambda_yj
 
     message = '\n'.join([
         title,
@@ -104,31 +177,135 @@ def transform(lst, title='', print_message=False, do_plot=False):
     return lst_bc, lst_yj, lambda_bc, lambda_yj
 
 
+def get_num_keys(data):
+    return [k for k in data[0].keys() if 'Index' in k or 'T' in k or 'WL' in k]
+
+
+def get_num_values(data):
+    # (row x numeric key) matrix
+    return np.array([[d[k] for k in get_num_keys(data)] for d in data], dtype=float)
+
+
+def box_cox_columns(values):
+    # Box-Cox transforms of all columns of a (row x column) matrix, as the first result of transform()
+    # of each column (with the same offsets, and standardized), with lambdas from get_box_cox_lambda()
+    result = np.empty(values.shape, order='F')
+    for i, (key, column) in enumerate(iter_shifted_columns(values)):
+        with np.errstate(invalid='ignore'):
+            result[:, i] = special.boxcox(column, get_box_cox_lambda(key, column))
+    # Scaled as by PowerTransformer, one column at a time for the same rounding
+    return np.column_stack([StandardScaler().fit_transform(result[:, [i]])[:, 0] for i in range(values.shape[1])])
+
+
+def iter_shifted_columns(values):
+    # Cache key and column of each column of values, shifted to be positive as in transform()
+    offsets = np.where(values.min(0) < 0, -values.min(0) + 0.1, 0)
+    for i in range(values.shape[1]):
+        column = values[:, i] + offsets[i]
+        yield hashlib.sha1(column.tobytes()).hexdigest(), column
+
+
+def get_box_cox_lambda(key, column):
+    # Lambda of PowerTransformer(method='box-cox') fitted to a column, cached by key (see iter_shifted_columns())
+    if key not in lambdas_cache:
+        lambdas_cache[key] = fit_box_cox(column)
+    used_lambda_keys.add(key)
+    return lambdas_cache[key]
+
+
+def fit_box_cox(column):
+    return float(stats.boxcox(column[~np.isnan(column)], lmbda=None)[1])
+
+
+def read_lambdas_cache(json_filename):
+    # Lambdas fitted in earlier runs, if saved by write_lambdas_cache()
+    if os.path.exists(json_filename):
+        with open(json_filename, 'r') as f:
+            lambdas_cache.update(json.load(f))
+
+
+def write_lambdas_cache(json_filename):
+    # Only lambdas used in this run are kept, so the file does not grow with every changed input
+    with open(json_filename, 'w') as f:
+        json.dump(dict([(k, v) for k, v in lambdas_cache.items() if k in used_lambda_keys]), f)
+
+
 def read_data(temperatures_filename, sonorities_filename):
-    with open(temperatures_filename, 'r') as f:
-        next(f)
-        temperatures = [line.strip('\n').split(',') for line in f]
-    temperatures = [(line[0], [float(i) for i in line[1:]])
-                    for line in temperatures if line[1] != '--']
-    temperatures = dict(temperatures)
+    data = columns_2_rows(read_columns(temperatures_filename, sonorities_filename))
+    print('Doculects count:', len(data))
+    return data
+
+
+def read_columns(temperatures_filename, sonorities_filename):
+    # Data of read_data() as columns (NumPy arrays), with keys in the same order
+    names, temperatures = read_temperatures(temperatures_filename)
+    rows = dict([(name, i) for i, name in enumerate(names)])
 
     with open(sonorities_filename, 'r') as f:
         next(f)
         data = [line.strip('\n').split(',') for line in f]
-    data = [dict(
+    data = [line for line in data if line[0] in rows]
+    lons = [float(line[1]) for line in data]
+    lats = [float(line[2]) for line in data]
+    columns = dict(
         [
-            ('Name', line[0]),
-            ('Lon', float(line[1])),
-            ('Lat', float(line[2])),
-            ('Macroarea', coord_2_macroarea((float(line[1]), float(line[2])))),
-            ('Family', line[3].split('.')[0]),
-            ('Genus', line[3]),
-            ('WL', float(line[6])),
-        ] + [(f'Index{i}', float(v)) for i, v in enumerate(line[7:])] +
-        list(process_temperature(temperatures[line[0]]).items())
-    ) for line in data if line[0] in temperatures]
-    print('Doculects count:', len(data))
-    return data
+            ('Name', np.array([line[0] for line in data])),
+            ('Lon', np.array(lons)),
+            ('Lat', np.array(lats)),
+            ('Macroarea', coords_2_macroareas(lons, lats)),
+            ('Family', np.array([line[3].split('.')[0] for line in data])),
+            ('Genus', np.array([line[3] for line in data])),
+            ('WL', np.array([float(line[6]) for line in data])),
+        ] + [(f'Index{i}', np.array([float(line[7 + i]) for line in data]))
+             for i in range(len(data[0]) - 7 if data else 0)]
+    )
+    columns.update(get_temperature_statistics(temperatures[[rows[line[0]] for line in data]]))
+    return columns
+
+
+def read_temperatures(temperatures_filename):
+    # Names of doculects with temperature data, and a (doculect x month) matrix of their temperatures,
+    # from temperatures.csv, or from the store of get_temperature.py if temperatures_filename is its folder
+    if os.path.isdir(temperatures_filename):
+        return read_temperatures_from_store(temperatures_filename)
+    with open(temperatures_filename, 'r') as f:
+        month_count = len(next(f).split(',')) - 1
+        lines = [line.strip('\n').split(',', 1) for line in f]
+    lines = [line for line in lines if not line[1].startswith('--')]
+    temperatures = np.array(','.join([line[1] for line in lines]).split(',') if lines else [], dtype=float)
+    return [line[0] for line in lines], temperatures.reshape(len(lines), month_count)
+
+
+def read_temperatures_from_store(dirname, year_range=range(1982, 2023)):
+    # As read_temperatures() of temperatures.csv (months of year_range only). As the store is memory-mapped,
+    # only the rows of doculects are read from disk.
+    temperatures = read_temperatures_store(dirname)
+    columns = [i for i, ym in enumerate(temperatures.year_months) if ym[0] in year_range]
+    values = temperatures.get_doculect_values()[:, columns]
+    # As in temperatures.csv, doculects without data are those whose first month is masked
+    kept = ~np.ma.getmaskarray(values)[:, 0] if columns else np.full(len(values), True)
+    return [name for name, k in zip(temperatures.names, kept) if k], np.ma.getdata(values)[kept].astype(float)
+
+
+def get_temperature_statistics(temperatures):
+    # process_temperature() of all rows of a (doculect x month) matrix at once
+    mean_monthly = np.mean(temperatures.reshape(len(temperatures), -1, 12), 1)
+    result = {
+        'T': np.mean(temperatures, 1),
+        'T_max': mean_monthly.max(1),
+        'T_min': mean_monthly.min(1),
+        'T_sd': np.std(temperatures, 1),
+    }
+    result['T_diff'] = result['T_max'] - result['T_min']
+    return result
+
+
+def columns_2_rows(columns):
+    # Rows (dicts) of columns, with the types of values of read_data(): Python strings and floats,
+    # except temperature statistics, which are NumPy floats (written with 4 decimals by write_data())
+    keys = list(columns.keys())
+    values = [list(columns[k]) if k in TEMPERATURE_KEYS else columns[k].tolist() for k in keys]
+    return [dict(zip(keys, row)) for row in zip(*values)]
 
 
 def process_temperature(temperatures):
@@ -143,25 +320,73 @@ def process_temperature(temperatures):
     return result
 
 
-def grouped_by(data, key):
-    num_keys = [k for k in data[0].keys() if 'Index' in k or 'T' in k or 'WL' in k]
-    names = set([d[key] for d in data])
-    return [dict(
-        [(key, name)] +
-        ([('Family', next(i['Family'] for i in data if i[key] == name))] if key == 'Genus' else []) +
-        [(k, func([i[k] for i in data if i[key] == name])) for k in num_keys] +
-        [('Method', method)]
-    ) for name in names for (method, func) in [('mean', np.average), ('median', np.median)]]
+def grouped_by(data, key, methods=(('mean', np.average), ('median', np.median))):
+    return grouped_by_keys(data, [key], methods)[key]
+
+
+def grouped_by_keys(data, keys, methods=(('mean', np.average), ('median', np.median))):
+    # Data grouped by each of keys, in rows of grouped_by(), sorted by group name.
+    # For each key, rows are sorted by group once, and each method aggregates all groups at once.
+    # methods: (name, func), where func aggregates a (row x column) matrix along axis 0
+    num_keys = get_num_keys(data)
+    values = np.array([[d[k] for k in num_keys] for d in data], dtype=float)
+    families = [d['Family'] for d in data]
+    result = {}
+    for key in keys:
+        names, groups = np.unique([d[key] for d in data], return_inverse=True)
+        order = np.argsort(groups, kind='stable')  # Rows of each group stay in order
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(groups))))
+        aggregates = [(method, aggregate_segments(values[order], offsets, func)) for method, func in methods]
+        result[key] = [dict(
+            [(key, name)] +
+            ([('Family', families[order[offsets[i]]])] if key == 'Genus' else []) +
+            list(zip(num_keys, aggregated[i])) +
+            [('Method', method)]
+        ) for i, name in enumerate(names.tolist()) for method, aggregated in aggregates]
+    return result
+
+
+def aggregate_segments(values, offsets, func):
+    # func of each segment values[offsets[i]:offsets[i + 1]] along axis 0
+    sizes = np.diff(offsets)
+    if func is np.average or func is np.mean:
+        return segment_means(values, offsets)
+    if func is np.median:
+        # Middle values (or the mean of the two) of each segment, sorted within segments
+        segments = np.repeat(np.arange(len(sizes)), sizes)
+        lower = offsets[:-1] + (sizes - 1) // 2
+        upper = offsets[:-1] + sizes // 2
+        result = np.empty((len(sizes), values.shape[1]))
+        for j in range(values.shape[1]):
+            column = values[np.lexsort((values[:, j], segments)), j]
+            result[:, j] = (column[lower] + column[upper]) / 2
+        return result
+    return np.array([func(values[a:b], axis=0) for a, b in zip(offsets[:-1], offsets[1:])])
 
 
 def transform_data(data, do_plot=False):
-    def transform_key(key):
-        transformed = transform([d[key] for d in data], key, do_plot)[0]
-        for i, d in enumerate(data):
-            d[key + '_trans'] = transformed[i]
-    num_keys = [k for k in data[0].keys() if 'Index' in k or 'T' in k or 'WL' in k]
-    for k in num_keys:
-        transform_key(k)
+    # Adds the Box-Cox transforms of numeric keys as key + '_trans'.
+    # do_plot is passed to transform() as print_message, so only messages are printed.
+    num_keys = get_num_keys(data)
+    if do_plot:
+        transformed = np.column_stack([transform([d[k] for d in data], k, do_plot)[0] for k in num_keys])
+    else:
+        transformed = box_cox_columns(get_num_values(data))
+    for i, d in enumerate(data):
+        for j, k in enumerate(num_keys):
+            d[k + '_trans'] = transformed[i, j]
+
+
+def transform_levels(levels, workers=None):
+    # transform_data() of each of levels (lists of rows, e.g. data, families and genera).
+    # With workers, lambdas not cached yet are fitted in a process pool first.
+    if workers:
+        columns = dict([item for data in levels for item in iter_shifted_columns(get_num_values(data))])
+        keys = [key for key in columns if key not in lambdas_cache]
+        with ProcessPoolExecutor(workers) as executor:
+            lambdas_cache.update(zip(keys, executor.map(fit_box_cox, [columns[key] for key in keys])))
+    for data in levels:
+        transform_data(data)
 
 
 def write_data(data, csv_filename):
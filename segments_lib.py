@@ -0,0 +1,21 @@
+import numpy as np
+
+# Aggregates of segments of arrays, with the same rounding as NumPy aggregates of each segment
+
+
+def segment_means(values, offsets):
+    # Means of values[offsets[i]:offsets[i + 1]] along the first axis; NaN for empty segments.
+    # For the same results as np.average of each column (which are often rounded at ties), values are
+    # added as it does: in order for fewer than 8 values, otherwise pairwise (by np.sum itself)
+    counts = np.diff(offsets)
+    sums = np.zeros((len(counts),) + values.shape[1:])
+    short = np.where((counts > 0) & (counts < 8))[0]
+    sums[short] = values[offsets[short]]
+    for k in range(1, 8):
+        added = short[counts[short] > k]
+        sums[added] += values[offsets[added] + k]
+    columns = np.asfortranarray(values)
+    for i in np.where(counts >= 8)[0].tolist():
+        sums[i] = columns[offsets[i]:offsets[i + 1]].sum(0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts.reshape((-1,) + (1,) * (values.ndim - 1))
@@ -1,4 +1,7 @@
 import re
+import threading
+from collections import OrderedDict
+import numpy as np
 from numpy import average
 from lingpy.sequence.sound_classes import asjp2tokens
 
@@ -36,9 +39,13 @@ sonority_scales = [
     ('   a   ', [17,  100, 7, 5, 2, 3],        'low vowel'),
 ]
 
+SCALE_COUNT = len(sonority_scales[0][1])
+
 token2type = dict([(token, line[2]) for line in sonority_scales
                    for token in line[0].replace(' ', '')])
 token2index = {}
+token2row = dict([(token, i) for i, line in enumerate(sonority_scales)
+                  for token in line[0].replace(' ', '')])
 
 asjp2tokens_patch = {
     # Both combination orders are actually correct, but asjp2tokens() currently recognizes only one of them
@@ -68,20 +75,50 @@ def set_token2index(scale_no, index_for_clicks):
         token2index['!'] = index_for_clicks
 
 
+def get_token2indices(indices_for_click=None):
+    # Like token2index, but maps each token to its indices in all scales at once
+    result = dict([(token, np.array(line[1], dtype=float)) for line in sonority_scales
+                   for token in line[0].replace(' ', '')])
+    if indices_for_click:
+        result['!'] = np.array([v if v else result['!'][i]
+                                for i, v in enumerate(indices_for_click)])
+    return result
+
+
+def get_row_values(scale_nos=None):
+    # Indices of each line of sonority_scales (line x scale), which can be altered for a sweep
+    scale_nos = range(SCALE_COUNT) if scale_nos is None else scale_nos
+    return np.array([[line[1][i] for i in scale_nos] for line in sonority_scales], dtype=float)
+
+
 # Phone: a phone (segment) presented in one or multiple ASJPcode tokens
 # Base: the base token(s) of a multi-token phone (e.g. 'thy' has the base 't' and suffixes 'h', 'y')
-def phone2index(phone):
+def phone2index(phone, table=None):
+    if table is not None:
+        i = table.phone2id(phone)  # May add rows to table.values
+        return table.values[i]
     base, tags = phone2base_and_tags(phone)
+    return base_and_tags2index(base, tags, token2index)
+
+
+def base_and_tags2index(base, tags, token2index):
+    # Also works when token2index maps tokens to vectors of indices in all scales
     indices = [token2index[i] for i in base]
-    index = average(indices) if 'prenasalized' in tags else min(indices)
+    index = average(indices, 0) if 'prenasalized' in tags else np.min(indices, 0)
     if 'aspirated/devoiced' in tags:
         # Sonority index of devoiced sonorants will be treated equal to 'h'
-        index = min(index, token2index['h'])
+        index = np.minimum(index, token2index['h'])
     # Other tags of secondary articulation will be ignored when calculating the index
     return index
 
 
 def phone2base_and_tags(phone):
+    table = get_phone_table()
+    i = table.phone2id(phone)
+    return (table.bases[i], list(table.tags[i]))  # A copy, so callers cannot change the table
+
+
+def parse_phone(phone):
     tags = set()
     phone = list(phone)
     for i in range(1, len(phone)):
@@ -102,6 +139,70 @@ def phone2base_and_tags(phone):
     return (phone, tags)
 
 
+class PhoneTable:
+    # Each distinct phone is parsed once, when first seen, and given an ID.
+    # Row ID of values holds the indices of the phone in all scales.
+    def __init__(self, indices_for_click=None):
+        self.token2indices = get_token2indices(indices_for_click)
+        self.ids = {}
+        self.phones = []
+        self.bases = []
+        self.tags = []
+        self.valid = []
+        self.values = np.zeros((256, SCALE_COUNT))
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.phones)
+
+    def phone2id(self, phone):
+        i = self.ids.get(phone)
+        if i is None:
+            with self.lock:
+                i = self.ids.get(phone)
+                if i is None:
+                    i = self.add(phone)
+        return i
+
+    def phones2ids(self, phones):
+        return [self.phone2id(phone) for phone in phones]
+
+    def add(self, phone):
+        i = len(self.phones)
+        base, tags = parse_phone(phone)
+        valid = len(phone) > 0 and len(base) > 0 and all(t in token2type for t in base)
+        if i == len(self.values):
+            self.values = np.concatenate((self.values, np.zeros_like(self.values)))
+        self.values[i] = base_and_tags2index(base, tags, self.token2indices) if valid else np.nan
+        self.phones.append(phone)
+        self.bases.append(base)
+        self.tags.append(tags)
+        self.valid.append(valid)
+        # Published last, as phone2id() reads ids without the lock
+        self.ids[phone] = i
+        return i
+
+    def get_values(self, row_values):
+        # Indices of all phones (phone x candidate), given indices of each line of sonority_scales
+        # (line x candidate, see get_row_values()). Rules for prenasalized and devoiced phones still apply.
+        token2values = dict([(token, row_values[row]) for token, row in token2row.items()])
+        result = np.full((len(self), row_values.shape[1]), np.nan)
+        for i, base in enumerate(self.bases):
+            if self.valid[i]:
+                result[i] = base_and_tags2index(base, self.tags[i], token2values)
+        return result
+
+
+phone_tables = {}
+
+
+def get_phone_table(indices_for_click=None):
+    key = tuple(indices_for_click) if indices_for_click else None
+    if key not in phone_tables:
+        phone_tables[key] = PhoneTable(indices_for_click)
+    return phone_tables[key]
+
+
 def split_geminate_tokens(tokens):
     i = 0
     while i < len(tokens):
@@ -120,7 +221,46 @@ def split_geminate_tokens(tokens):
     return tokens
 
 
-def word2phones(word, merge_vowels=False):
+class PhonesCache:
+    # Tokenized words keyed by (form, merge_vowels), least recently used evicted first.
+    # Items are read and changed under a lock, so it can be shared by threads.
+    def __init__(self, max_size=500000):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, word, merge_vowels=False):
+        key = (word, merge_vowels)
+        with self.lock:
+            phones = self.items.get(key)
+            if phones is not None:
+                self.hits += 1
+                self.items.move_to_end(key)
+                return phones
+            self.misses += 1
+        phones = tuple(tokenize_word(word, merge_vowels))
+        with self.lock:
+            self.items[key] = phones
+            if len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+        return phones
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __str__(self):
+        return f'Phones cache: {len(self.items)} words, {self.hits} hits, {self.misses} misses'
+
+
+phones_cache = PhonesCache()
+
+
+def tokenize_word(word, merge_vowels=False):
     word = word.replace(' ', '')
     for pair in asjp2tokens_patch.items():
         word = word.replace(*pair)
@@ -130,8 +270,17 @@ def word2phones(word, merge_vowels=False):
     return phones
 
 
-def word2index(word, merge_vowels=False):
-    return average([phone2index(i) for i in word2phones(word, merge_vowels)])
+def word2phones(word, merge_vowels=False):
+    # Returns a tuple shared with the cache, so it should not be modified
+    return phones_cache.get(word, merge_vowels)
+
+
+def word2index(word, merge_vowels=False, table=None):
+    phones = word2phones(word, merge_vowels)
+    if table is None:
+        return average([phone2index(i) for i in phones])
+    ids = table.phones2ids(phones)  # May add rows to table.values
+    return average(table.values[ids], 0)
 
 
 def classify_phones(phone_counts):
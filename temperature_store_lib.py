@@ -0,0 +1,44 @@
+import numpy as np
+from array_store_lib import read_arrays
+
+# Temperatures, their binary store and the binary global grid, without the netCDF dependencies of get_temperature_lib
+
+
+class Temperatures:
+    # values: masked (point x year_month) array
+    # names, doculect_points: names of doculects and the row of points (and values) of each, if known
+    def __init__(self, year_months, points, values, names=None, doculect_points=None):
+        self.year_months = year_months
+        self.points = points
+        self.values = values
+        self.names = names
+        self.doculect_points = doculect_points
+
+    def get_doculect_values(self):
+        return self.values[self.doculect_points]
+
+
+def select_years(temperatures: Temperatures, year_range):
+    columns = [i for i, ym in enumerate(temperatures.year_months) if ym[0] in year_range]
+    return Temperatures([temperatures.year_months[i] for i in columns], temperatures.points,
+                        temperatures.values[:, columns], temperatures.names, temperatures.doculect_points)
+
+
+def read_temperatures_store(dirname, mmap_mode='r'):
+    # Values are memory-mapped, so slicing them reads only the slices from disk
+    arrays, meta = read_arrays(dirname, mmap_mode)
+    return Temperatures([tuple(ym) for ym in arrays['year_months'].tolist()],
+                        arrays['points'],
+                        np.ma.array(arrays['values'], mask=arrays['mask'], copy=False),
+                        meta.get('names'), arrays.get('doculect_points'))
+
+
+def write_global_grid(grid, npz_filename):
+    np.savez_compressed(npz_filename,
+                        values=np.ma.getdata(grid).astype(np.float32),
+                        mask=np.ma.getmaskarray(grid))
+
+
+def read_global_grid(npz_filename):
+    with np.load(npz_filename) as f:
+        return np.ma.array(f['values'], mask=f['mask'])
@@ -0,0 +1,23 @@
+import os
+import pytest
+import benchmark_lib
+
+NUM_KEYS = ['WL'] + ['Index%d' % i for i in range(7)] + ['T', 'T_max', 'T_min', 'T_sd', 'T_diff']
+
+
+def read_header(csv_filename):
+    with open(csv_filename, 'r') as f:
+        return next(f).strip('\n').split(',')
+
+
+def test_run_pipeline(tmp_path):
+    pytest.importorskip('process_lib')  # Needs the plotting packages
+    results = benchmark_lib.run_pipeline(str(tmp_path), doculect_count=40, year_count=1, repeat=1)
+    assert 'transform_data' in results
+    out_dir = os.path.join(tmp_path, 'output')
+    # Each numeric key is transformed once, at each level but macroareas
+    for name in ['data.csv', 'data_family.csv', 'data_genus.csv']:
+        header = read_header(os.path.join(out_dir, name))
+        assert [k for k in header if k.endswith('_trans')] == [k + '_trans' for k in NUM_KEYS]
+        assert not [k for k in header if '_trans_' in k]
+    assert not [k for k in read_header(os.path.join(out_dir, 'data_macroarea.csv')) if '_trans' in k]
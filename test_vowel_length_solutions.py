@@ -2,7 +2,7 @@ import get_sonority_lib as lib
 from sys import argv
 
 raw_path = argv[1]
-doculects = lib.open_doculects(raw_path)
+doculects = lib.open_doculects(raw_path, 'data/asjp_cache')
 words_to_include = [  # 40 words
     'I', 'you', 'we', 'one', 'two', 'person', 'fish', 'dog', 'louse', 'tree',
     'leaf', 'skin', 'blood', 'bone', 'horn', 'ear', 'eye', 'nose', 'tooth', 'tongue',